@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of read_columns against the scripts' Read_Two_Column_File and
+plain np.loadtxt.
+
+    python bench_parse.py [rows ...]
+
+Writes a two-column file like mo_makeplot's for every row count (default
+1e4 to 1e7) into a temporary directory and times the three parsers on it.
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from wiggler_parse import read_columns
+
+
+def Read_Two_Column_File(file_name):
+    with open(file_name, 'r') as data:
+        x = []
+        y = []
+        for line in data:
+            p = line.split()
+            x.append(float(p[0]))
+            y.append(float(p[1]))
+    return x, y
+
+
+def best_of(function, repeat):
+    times = []
+    for _ in range(repeat):
+        t = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter()-t)
+    return min(times), result
+
+
+if __name__ == '__main__':
+    sizes = [int(float(a)) for a in sys.argv[1:]] or [10**4, 10**5, 10**6, 10**7]
+    print('%10s %14s %14s %16s %8s' % ('rows', 'lists [s]', 'loadtxt [s]', 'read_columns [s]',
+                                        'speedup'))
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in sizes:
+            name = os.path.join(tmp, 'temp_B_%d.txt' % n)
+            x = np.linspace(0, 6750, n)
+            np.savetxt(name, np.column_stack([x, np.sin(x/40)]), fmt='%.10e', delimiter='\t')
+            repeat = 3 if n <= 10**6 else 1
+            t_old, (xl, bl) = best_of(lambda: Read_Two_Column_File(name), repeat)
+            t_txt, _ = best_of(lambda: np.loadtxt(name), repeat)
+            t_new, data = best_of(lambda: read_columns(name), repeat)
+            assert np.array_equal(data[:, 1], bl)
+            print('%10d %14.4f %14.4f %16.4f %8.1f' % (n, t_old, t_txt, t_new, t_old/t_new))
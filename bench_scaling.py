@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+"""
+Phase-timed benchmark of the FEMM pipeline against the device length.
+
+    python bench_scaling.py [--femm] [--numrepeats 1 5 ...] [--numpoints 25000 ...]
+                            [--results DIR]
+
+The on-axis model is run for every numrepeats (default 1, 5, 10, 20, 39,
+41, 80) and every numpoints, and wall time and peak Python memory are
+recorded per phase:
+
+    design    onaxis_design
+    build     build_onaxis_model (nodes, segments, labels)
+    compile   FemModel.tostring, i.e. the drawing clean-up that replaces
+              mi_copytranslate2 and FEMM's node/segment merging
+    write     writing the .FEM file
+    open      opendocument
+    mesh      mi_createmesh
+    analyze   mi_analyze
+    load      mi_loadsolution
+    readout   the batched mo_getb loop (replaces mo_addcontour+mo_makeplot)
+    parse     read_columns of the readout file
+    plot      plotting the profile to a PNG (skipped without matplotlib)
+
+Memory is the tracemalloc peak of the phase, so it does not include what
+FEMM itself allocates in its own process. Every row is appended as a JSON
+line to the history file (bench_scaling.jsonl) and the run is written to
+bench_scaling.csv, both in the results directory (bench_results/ of the
+working directory unless given). A power law t = a*numrepeats**k is fitted per phase and
+numpoints over the run.
+
+By default the FEMM calls go to wiggler_standin.StandinFemm, which keeps
+the pipeline runnable where FEMM is not installed (e.g. in CI) but whose
+mesh, analyze and load phases cost nothing; --femm runs real FEMM.
+"""
+
+import argparse
+import csv
+import json
+import os
+import platform
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+from wiggler_design import onaxis_design
+from wiggler_femfile import build_onaxis_model
+from wiggler_parse import read_columns
+from wiggler_readout import FemmReadout
+
+NUMREPEATS = (1, 5, 10, 20, 39, 41, 80)
+NUMPOINTS = (2500, 25000)
+PHASES = ('design', 'build', 'compile', 'write', 'open', 'mesh', 'analyze', 'load',
+          'readout', 'parse', 'plot')
+RESULTS = 'bench_results'
+HISTORY = 'bench_scaling.jsonl'
+CSV_FILE = 'bench_scaling.csv'
+
+
+class _Phases:
+    """Times and traces the memory of consecutive phases into a row."""
+
+    def __init__(self, row):
+        self.row = row
+
+    def __call__(self, name, function, *args):
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        t = time.perf_counter()
+        result = function(*args)
+        self.row[name+'_time'] = time.perf_counter()-t
+        self.row[name+'_mem'] = tracemalloc.get_traced_memory()[1]-base
+        return result
+
+
+def _plot(s, by, filename):
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    fig = plt.figure()
+    fig.add_subplot(111).plot(s, by)
+    fig.savefig(filename)
+    plt.close(fig)
+
+
+def run_case(femm, numrepeats, numpoints, scratch, backend):
+    """One pass through all phases; returns the row of times [s] and peaks [bytes]."""
+    row = dict(backend=backend, numrepeats=numrepeats, numpoints=numpoints)
+    phase = _Phases(row)
+    p = phase('design', lambda: onaxis_design(numrepeats=numrepeats))
+    if hasattr(femm, 'set_design'):
+        femm.set_design(p)  # the stand-in answers with the field of this design
+    model = phase('build', build_onaxis_model, p)
+    text = phase('compile', model.tostring)
+    filename = os.path.join(scratch, 'wiggle.FEM')
+
+    def write():
+        with open(filename, 'w', newline='\n') as f:
+            f.write(text)
+    phase('write', write)
+    phase('open', femm.opendocument, filename)
+    phase('mesh', femm.mi_createmesh)
+    phase('analyze', femm.mi_analyze, 0)
+    phase('load', femm.mi_loadsolution)
+    row['elements'] = femm.mo_numelements()
+
+    s = np.linspace(0, p['lengthtotal']+2*p['margin'], numpoints)
+    with FemmReadout(femm, scratch) as readout:
+        out = phase('readout', readout.run, s, np.zeros_like(s))
+        b = phase('parse', read_columns, out, 2)
+    try:
+        phase('plot', _plot, s, b[:, 1], os.path.join(scratch, 'profile.png'))
+    except ImportError:
+        pass
+    return row
+
+
+def fit_scaling(rows, phases=PHASES):
+    """{(phase, numpoints): (a, k)} of t = a*numrepeats**k by a log-log fit."""
+    fits = {}
+    for numpoints in sorted(set(row['numpoints'] for row in rows)):
+        sub = [row for row in rows if row['numpoints'] == numpoints]
+        for name in phases:
+            n = np.array([row['numrepeats'] for row in sub if name+'_time' in row], dtype=float)
+            t = np.array([row[name+'_time'] for row in sub if name+'_time' in row])
+            if len(set(n)) < 2 or (t <= 0).any():
+                continue
+            k, log_a = np.polyfit(np.log(n), np.log(t), 1)
+            fits[name, numpoints] = (np.exp(log_a), k)
+    return fits
+
+
+def benchmark(numrepeats=NUMREPEATS, numpoints=NUMPOINTS, femm=None, history=HISTORY,
+              csv_file=CSV_FILE, verbose=True, results=RESULTS):
+    """Run all cases, append them to the history, write the CSV, return (rows, fits).
+
+    history and csv_file are relative to the results directory, which is
+    created if needed; None skips the file.
+    """
+    if femm is None:
+        from wiggler_standin import StandinFemm
+        femm, backend = StandinFemm(onaxis_design()), 'standin'
+    else:
+        backend = 'femm'
+    femm.openfemm(1)
+    stamp = time.strftime('%Y-%m-%dT%H:%M:%S')
+    rows = []
+    tracemalloc.start()
+    try:
+        with tempfile.TemporaryDirectory(prefix='wiggler_bench_') as scratch:
+            for n in numrepeats:
+                for m in numpoints:
+                    row = dict(run_case(femm, n, m, scratch, backend), date=stamp,
+                               host=platform.node())
+                    rows.append(row)
+                    if verbose:
+                        print('numrepeats %3d, numpoints %7d: %.3f s'
+                              % (n, m, sum(row[k] for k in row if k.endswith('_time'))))
+    finally:
+        tracemalloc.stop()
+        femm.closefemm()
+
+    if history or csv_file:
+        os.makedirs(results, exist_ok=True)
+    if history:
+        with open(os.path.join(results, history), 'a') as f:
+            for row in rows:
+                f.write(json.dumps(row)+'\n')
+    if csv_file:
+        columns = ['date', 'host', 'backend', 'numrepeats', 'numpoints', 'elements']
+        columns += [name+suffix for name in PHASES for suffix in ('_time', '_mem')]
+        with open(os.path.join(results, csv_file), 'w', newline='') as f:
+            writer = csv.DictWriter(f, columns, restval='')
+            writer.writeheader()
+            writer.writerows(rows)
+    return rows, fit_scaling(rows)
+
+
+def scaling_table(fits):
+    """Printable table of fit_scaling()."""
+    lines = ['%10s %10s %12s %8s' % ('phase', 'numpoints', 'a [s]', 'k')]
+    for (name, numpoints), (a, k) in sorted(fits.items(), key=lambda f: (f[0][1], PHASES.index(f[0][0]))):
+        lines.append('%10s %10d %12.3g %8.2f' % (name, numpoints, a, k))
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('--femm', action='store_true', help='run real FEMM instead of the stand-in')
+    parser.add_argument('--numrepeats', type=int, nargs='+', default=NUMREPEATS)
+    parser.add_argument('--numpoints', type=int, nargs='+', default=NUMPOINTS)
+    parser.add_argument('--history', default=HISTORY)
+    parser.add_argument('--results', default=RESULTS, help='directory of the history and CSV files')
+    args = parser.parse_args()
+    femm = None
+    if args.femm:
+        import femm
+    rows, fits = benchmark(args.numrepeats, args.numpoints, femm, args.history,
+                           results=args.results)
+    print(scaling_table(fits))
@@ -0,0 +1,2 @@
+# -*- coding: utf-8 -*-
+# lets pytest import the wiggler_* modules from the repository root
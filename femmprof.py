@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+"""
+Per-call profiling of the femm module.
+
+The scripts drive FEMM through hundreds to thousands of femm.mi_* and
+femm.mo_* calls. ProfiledFemm wraps a femm module (or anything with the
+same functions) and records, per function, the number of calls, the
+cumulative and the largest latency and the argument shapes seen, plus a
+timeline of every call. At exit it prints a report sorted by cumulative
+time and can write the timeline as a Chrome trace (chrome://tracing,
+Perfetto) and the call inventory as plain text.
+
+RecordingFemm is a stub that accepts every femm call and returns a
+neutral value, so the call inventory of a script can be produced on Linux
+without FEMM and diffed between script variants, e.g. in CI:
+
+    python femmprof.py --stub --calls calls_6.txt wiggler_6_onaxis.py
+    python femmprof.py --trace trace.json wiggler_6_onaxis.py   (real FEMM)
+
+With --stub the script runs in a temporary working directory (stub_cwd),
+so the placeholder files, written to the scripts' Windows paths
+('C:/Users/.../temp_B.txt', relative anywhere else), never land in the
+checkout.
+
+Inside a script, femm = femmprof.install() before any "import femm" does
+the same.
+"""
+
+import argparse
+import atexit
+import contextlib
+import json
+import os
+import runpy
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+
+def arg_shape(value):
+    """Short description of an argument: its type, or shape for arrays and sequences."""
+    if isinstance(value, bool):
+        return 'bool'
+    if isinstance(value, (int, float, np.integer, np.floating)):
+        return 'num'  # 0 and 0.0 are the same to FEMM
+    if isinstance(value, str):
+        return 'str'
+    if isinstance(value, np.ndarray):
+        return 'array%s' % (value.shape,)
+    if isinstance(value, (list, tuple)):
+        return '%s[%d]' % (type(value).__name__, len(value))
+    return type(value).__name__
+
+
+def signature(args, kwargs):
+    return '(%s)' % ', '.join([arg_shape(a) for a in args]
+                              + ['%s=%s' % (k, arg_shape(v)) for k, v in sorted(kwargs.items())])
+
+
+class RecordingFemm:
+    """Stand-in femm module that accepts any call and returns a neutral value.
+
+    returns maps function names to fixed return values; other functions
+    return None. mo_getb returns zero field, mo_numelements 0. Calls whose
+    output file the script reads back write a zero-field placeholder, so
+    the script runs on: mo_makeplot with a file name (numpoints rows along
+    the mo_addcontour points) and the dofile() readout of FemmReadout.
+    """
+
+    RETURNS = dict(mo_getb=(0.0, 0.0), mo_getpointvalues=(0.0,)*14, mo_numelements=0,
+                   mo_numnodes=0, mo_getprobleminfo=(0, 0.0, 1.0, 1e-3), mo_blockintegral=0.0,
+                   mo_lineintegral=(0.0, 0.0), mi_createmesh=0)
+
+    def __init__(self, returns=None):
+        self.returns = dict(self.RETURNS, **(returns or {}))
+        self.contour = []
+
+    def mo_addcontour(self, x, y):
+        self.contour.append((x, y))
+
+    def mo_clearcontour(self):
+        self.contour = []
+
+    def mo_makeplot(self, plottype, numpoints, filename=None, fileformat=0):
+        if filename:
+            xy = np.array(self.contour or [(0, 0)], dtype=float)
+            length = np.hypot(*np.diff(xy, axis=0).T).sum()
+            _write(filename, np.column_stack([np.linspace(0, length, int(numpoints)),
+                                              np.zeros(int(numpoints))]))
+
+    def callfemm_noeval(self, expression):
+        from wiggler_standin import read_points, readout_files
+
+        points, out = readout_files(expression)
+        _write(out, np.zeros((len(read_points(points)), 2)))
+
+    callfemm = callfemm_noeval
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        value = self.returns.get(name)
+
+        def call(*args, **kwargs):
+            return value
+        call.__name__ = name
+        return call
+
+
+@contextlib.contextmanager
+def stub_cwd(prefix='femmprof_'):
+    """Change into a fresh temporary directory for the body, removed after."""
+    cwd = os.getcwd()
+    scratch = tempfile.mkdtemp(prefix=prefix)
+    os.chdir(scratch)
+    try:
+        yield scratch
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+def _write(filename, columns):
+    directory = os.path.dirname(filename)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    np.savetxt(filename, columns, fmt='%.17g')
+
+
+class ProfiledFemm:
+    """Proxy of a femm module that records every function call.
+
+    stats maps function name to dict(count, total, max, shapes) with times
+    in seconds and shapes the set of argument signatures; events is the
+    timeline as (name, start, duration, signature) with start relative to
+    the creation of the proxy.
+    """
+
+    def __init__(self, femm=None):
+        if femm is None:
+            import femm
+        self._femm = femm
+        self._t0 = time.perf_counter()
+        self.stats = {}
+        self.events = []
+
+    def __getattr__(self, name):
+        value = getattr(self._femm, name)
+        if not callable(value) or name.startswith('_'):
+            return value
+
+        def call(*args, **kwargs):
+            t = time.perf_counter()
+            try:
+                return value(*args, **kwargs)
+            finally:
+                dt = time.perf_counter()-t
+                sig = signature(args, kwargs)
+                s = self.stats.setdefault(name, dict(count=0, total=0.0, max=0.0, shapes=set()))
+                s['count'] += 1
+                s['total'] += dt
+                s['max'] = max(s['max'], dt)
+                s['shapes'].add(sig)
+                self.events.append((name, t-self._t0, dt, sig))
+        call.__name__ = name
+        return call
+
+    def report(self, limit=None):
+        """Table of the functions sorted by cumulative time."""
+        total = sum(s['total'] for s in self.stats.values())
+        lines = ['%-26s %8s %12s %8s %12s %12s  %s' % ('function', 'calls', 'total [s]', '%',
+                                                       'mean [ms]', 'max [ms]', 'arguments')]
+        ranked = sorted(self.stats.items(), key=lambda item: -item[1]['total'])
+        for name, s in ranked[:limit]:
+            lines.append('%-26s %8d %12.4f %8.1f %12.4f %12.4f  %s'
+                         % (name, s['count'], s['total'], 100*s['total']/(total or 1),
+                            1e3*s['total']/s['count'], 1e3*s['max'], ' '.join(sorted(s['shapes']))))
+        lines.append('%-26s %8d %12.4f' % ('total', sum(s['count'] for s in self.stats.values()),
+                                           total))
+        return '\n'.join(lines)
+
+    def inventory(self):
+        """One line per function and argument signature with its count, sorted by name.
+
+        Free of timings, so the inventories of two runs diff cleanly.
+        """
+        counts = {}
+        for name, _, _, sig in self.events:
+            counts[name+sig] = counts.get(name+sig, 0)+1
+        return ''.join('%6d %s\n' % (n, key) for key, n in sorted(counts.items()))
+
+    def chrome_trace(self, filename):
+        """Write the timeline in the Chrome trace event format."""
+        events = [dict(name=name, cat=name.split('_')[0] if '_' in name else 'femm', ph='X',
+                       ts=1e6*start, dur=1e6*dt, pid=os.getpid(), tid=0,
+                       args=dict(arguments=sig))
+                  for name, start, dt, sig in self.events]
+        with open(filename, 'w') as f:
+            json.dump(dict(traceEvents=events, displayTimeUnit='ms'), f)
+        return filename
+
+
+def install(femm=None, stub=False, trace=None, calls=None, report=True):
+    """Put a ProfiledFemm in sys.modules['femm'] and report at exit.
+
+    Later "import femm" statements get the proxy. stub profiles a
+    RecordingFemm instead of the real module; trace and calls are file
+    names for chrome_trace() and inventory().
+    """
+    profiled = ProfiledFemm(RecordingFemm() if stub else femm)
+
+    def at_exit():
+        if report:
+            print(profiled.report(), file=sys.stderr)
+        if trace:
+            profiled.chrome_trace(trace)
+        if calls:
+            with open(calls, 'w') as f:
+                f.write(profiled.inventory())
+    atexit.register(at_exit)
+    sys.modules['femm'] = profiled
+    return profiled
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Profile the femm calls of a script.')
+    parser.add_argument('--stub', action='store_true', help='record against a stub instead of FEMM')
+    parser.add_argument('--trace', help='write a Chrome trace of the calls to this file')
+    parser.add_argument('--calls', help='write the call inventory to this file')
+    parser.add_argument('script')
+    parser.add_argument('args', nargs=argparse.REMAINDER)
+    args = parser.parse_args()
+    # the stub runs the script elsewhere, so resolve the paths here first
+    script, trace, calls = [os.path.abspath(name) if name else name
+                            for name in (args.script, args.trace, args.calls)]
+    install(stub=args.stub, trace=trace, calls=calls)
+    sys.argv = [args.script]+args.args
+    sys.path.insert(0, os.path.dirname(script))
+    with stub_cwd() if args.stub else contextlib.nullcontext():
+        runpy.run_path(script, run_name='__main__')
@@ -0,0 +1,16 @@
+# -*- coding: utf-8 -*-
+import json
+
+from wiggler_sweep import sweep
+
+
+def test_sweep_applies_saved_mesh_only_when_asked(tmp_path, monkeypatch):
+    # a saved selection in the working directory must not leak into sweeps
+    monkeypatch.chdir(tmp_path)
+    with open('wiggler_mesh.json', 'w') as f:
+        json.dump(dict(mesh=dict(magnetSep=40)), f)
+    cases = [dict(numrepeats=3)]
+    implicit, = sweep(cases, workers=1, numpoints=2000)
+    explicit, = sweep(cases, workers=1, numpoints=2000, mesh='wiggler_mesh.json')
+    assert implicit['status'] == explicit['status'] == 'ok'
+    assert explicit['peak_By'] < implicit['peak_By']
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+
+from wiggler_sweep import analytic_solver
+from wiggler_taper import optimize_taper
+
+
+def extras_solver(p, scratch, numpoints):
+    # stands in for femm_solver, which adds a dict of extra result columns
+    s, by = analytic_solver(p, scratch, numpoints)
+    return s, by, dict(elements=0)
+
+
+def test_optimize_taper_accepts_extra_solver_columns():
+    result = optimize_taper(solver=extras_solver, numrepeats=5, numpoints=2000,
+                            solver_numpoints=2000)
+    assert result['converged']
+    assert result['solves'] == 1
+    assert np.abs(result['residual']).max() <= 1
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+"""
+Same device as wiggler_6_onaxis.py, but the geometry is compiled into a .FEM
+file by wiggler_femfile and handed to FEMM in one go instead of being drawn
+with thousands of mi_addnode/mi_drawline/mi_setblockprop calls.
+"""
+
+from wiggler_cache import SolutionCache, cached_readout
+from wiggler_design import onaxis_design
+from wiggler_femfile import build_onaxis_model
+from wiggler_headless import pyplot, show
+from wiggler_readout import FemmReadout, profile
+
+# modify these values to suit your needs, any wiggler_6_onaxis.py global can be given
+p = onaxis_design(magnetSep=25, magnetWidth=150, magnetType='N52', numrepeats=39)
+print('oddmagnetlength is', p['oddmagnetLength'], 'mm')
+print('Total length is', p['lengthtotal']/1000, 'm')
+print('End magnet width is', p['endmagnetWidth'], 'mm')
+print('Penultimate magnet width is', p['penmagnetWidth'], 'mm')
+
+model = build_onaxis_model(p)
+
+numpoints=25000
+def onaxis(femm):
+    # signed Bx/By/|B| along the axis in one batched request, no temp_B.txt
+    with FemmReadout(femm) as readout:
+        s, bx, by, b = profile(readout, 0, 0, p['lengthtotal']+2*p['margin'], 0, numpoints)
+    return dict(s=s, bx=bx, by=by, b=b)
+
+# FEMM is only started if this readout of this exact model is not cached yet,
+# and mi_analyze only runs if the model has never been solved
+field = cached_readout(model, SolutionCache(), 'onaxis_%d' % numpoints, onaxis)
+
+plt = pyplot()
+fig = plt.figure()
+ax = fig.add_subplot(111)
+plt.plot(field['s'], field['by'])
+show('wiggler_7_femfile')
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""
+Regression check of the symmetry-reduced models against the full model.
+
+The half model (halfModel=True, y >= 0), the half-length model
+(halfLength=True, s up to the device centre) and both combined are solved
+(or taken from the solution cache) next to the full model. By and Bx are
+compared over the full device length on the axis and on lines above and
+below it, the reduced models being read through symmetric_readout. Prints
+the element counts and the largest deviation on each line.
+"""
+
+import numpy as np
+
+from wiggler_cache import SolutionCache, cached_readout
+from wiggler_design import onaxis_design
+from wiggler_femfile import build_onaxis_model
+from wiggler_headless import pyplot, show
+from wiggler_readout import FemmReadout, profile, symmetric_readout
+
+# modify these values to suit your needs
+overrides = dict(magnetSep=25, magnetWidth=150, magnetType='N52', numrepeats=39)
+variants = {'full': {}, 'half': dict(halfModel=True), 'half length': dict(halfLength=True),
+            'quarter': dict(halfModel=True, halfLength=True)}
+lines = [0, 15, -15]  # y of the compared lines, mm
+numpoints = 25000
+
+cache = SolutionCache()
+results = {}
+for name, variant in variants.items():
+    p = onaxis_design(**dict(overrides, **variant))
+    right = p['lengthtotal']+2*p['margin']
+
+    def readout(femm):
+        out = dict(elements=np.array(femm.mo_numelements()))
+        with FemmReadout(femm) as femm_readout:
+            r = symmetric_readout(femm_readout, p)
+            for i, y in enumerate(lines):
+                s, bx, by, b = profile(r, 0, y, right, y, numpoints)
+                out['s'], out['bx%d' % i], out['by%d' % i] = s, bx, by
+        return out
+
+    results[name] = cached_readout(build_onaxis_model(p), cache, 'lines_%d' % numpoints, readout)
+
+full = results['full']
+print('full: %d elements, peak By %.4g T' % (full['elements'], np.abs(full['by0']).max()))
+for name in list(variants)[1:]:
+    r = results[name]
+    print('%s: %d elements' % (name, r['elements']))
+    for i, y in enumerate(lines):
+        print('  y = %5g mm: max |dBy| = %.3g T, max |dBx| = %.3g T'
+              % (y, np.abs(r['by%d' % i]-full['by%d' % i]).max(),
+                 np.abs(r['bx%d' % i]-full['bx%d' % i]).max()))
+
+plt = pyplot()
+fig = plt.figure()
+ax = fig.add_subplot(111)
+for name, r in results.items():
+    plt.plot(r['s'], r['by0'], label=name)
+plt.legend()
+show('wiggler_8_halfmodel')
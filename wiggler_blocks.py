@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+"""
+Magnet block table shared by the FEM writer, the analytic engine and the checks.
+
+The scripts place every block with literal arithmetic such as
+1.5*magnetLength+2*oddmagnetLength+4*interMagnet+margin, repeated for the
+top and bottom rows. Here a device is one NumPy structured array with a
+row per block (BLOCK: centre, size, material id, magdir, label group and
+row, +1 top, -1 bottom), built once from the design parameters of a
+variant. Repeating, mirroring and translating are whole-array operations
+and the consumers read the columns directly.
+
+    table = variant_table(script_design('attempt2'))
+"""
+
+import numpy as np
+
+from wiggler_design import MATERIALS, remanence
+
+BLOCK = np.dtype([('cx', 'f8'), ('cy', 'f8'), ('length', 'f8'), ('width', 'f8'),
+                  ('material', 'i2'), ('magdir', 'f8'), ('group', 'i2'), ('row', 'i1')])
+
+# material ids index this tuple
+MATERIAL_NAMES = tuple(MATERIALS)
+
+
+def material_id(name):
+    if name not in MATERIALS:
+        raise KeyError('no material data for %r, add it to wiggler_design.MATERIALS' % name)
+    return MATERIAL_NAMES.index(name)
+
+
+def make_blocks(cx, cy, length, width, magdir, material, group=0, row=None):
+    """Block table from columns, which broadcast together.
+
+    material is a name or id; row defaults to the sign of cy.
+    """
+    cx, cy, length, width, magdir = np.broadcast_arrays(*[np.asarray(v, dtype=float) for v in
+                                                          (cx, cy, length, width, magdir)])
+    table = np.zeros(cx.size, BLOCK)
+    table['cx'], table['cy'] = cx.ravel(), cy.ravel()
+    table['length'], table['width'] = length.ravel(), width.ravel()
+    table['magdir'] = magdir.ravel()
+    table['material'] = material_id(material) if isinstance(material, str) else material
+    table['group'] = group
+    table['row'] = np.sign(table['cy']) if row is None else row
+    return table
+
+
+def wrap(magdir):
+    """Angle in (-180, 180]."""
+    return 180-(180-np.asarray(magdir)) % 360
+
+
+def translate(table, dx=0, dy=0):
+    table = table.copy()
+    table['cx'] += dx
+    table['cy'] += dy
+    return table
+
+
+def repeat(table, period, copies):
+    """The table followed by copies translated by period, 2*period, ... (mi_copytranslate2)."""
+    shift = period*np.arange(copies+1)
+    out = np.repeat(table[None, :], copies+1, axis=0)
+    out['cx'] += shift[:, None]
+    return out.ravel()
+
+
+def mirror_rows(top):
+    """Top row (magdir wrapped) followed by its image in y = 0 with magdir -> 180-magdir.
+
+    The bottom row makes By even and Bx odd in y.
+    """
+    bottom = top.copy()
+    bottom['cy'] = -top['cy']
+    bottom['magdir'] = wrap(180-top['magdir'])
+    bottom['row'] = -top['row']
+    top = top.copy()
+    top['magdir'] = wrap(top['magdir'])
+    return np.concatenate([top, bottom])
+
+
+def mirror_ends(table, centre):
+    """Image of the blocks in s = centre with magdir -> -magdir (reversed order).
+
+    Continues a Halbach sequence antisymmetrically, By odd and Bx even about
+    the centre, like mi_mirror2 plus the magdir change in wiggler_6_onaxis.py.
+    """
+    image = table[::-1].copy()
+    image['cx'] = 2*centre-image['cx']
+    image['magdir'] = -image['magdir']
+    return image
+
+
+def halbach_cell(x0, lengths, cy, width, magdir0=0, inter=0, material='N52'):
+    """Top row of consecutive blocks starting at x0, magdir turning by -90 each.
+
+    lengths, cy and width broadcast over the blocks. The centres are summed
+    up block by block as in the scripts (x += inter, centre, x += length+inter).
+    """
+    lengths = np.asarray(lengths, dtype=float)
+    steps = np.empty(2*len(lengths)+1)
+    steps[0] = x0
+    steps[1::2] = inter
+    steps[2::2] = lengths+inter
+    starts = np.cumsum(steps)[1::2]
+    k = np.arange(len(lengths))
+    return make_blocks(starts+lengths/2, cy, lengths, width, magdir0-90*k, material, row=1)
+
+
+def device_centre(p):
+    """s of the end-to-end mirror plane of the v6 device.
+
+    The blocks follow each other with one interMagnet between them and one
+    before the first, so the row runs from margin+interMagnet over
+    lengthtotal and its middle is interMagnet past margin+lengthtotal/2.
+    """
+    return p['margin']+p['interMagnet']+p['lengthtotal']/2
+
+
+def onaxis_table(p):
+    """Blocks of the tapered wiggler_6_onaxis.py device (v6), top row then bottom row.
+
+    One continuous Halbach sequence (magdir 0, -90, 180, 90, ...) of
+    numrepeats+2 cells and an odd block, the first four blocks with the end
+    and penultimate separations and widths, whose exit end is the entrance
+    end mirrored about device_centre(p).
+    """
+    nblocks = 4*(p['numrepeats']+2)+1  # end cell plus numrepeats+1 copies, plus the odd block
+    k = np.arange(nblocks)
+    sep = np.full(nblocks, float(p['magnetSep']))
+    width = np.full(nblocks, float(p['magnetWidth']))
+    sep[:4] = [p['endmagnetSep'], p['endmagnetSep'], p['penmagnetSep'], p['penmagnetSep']]
+    width[:4] = [p['endmagnetWidth'], p['endmagnetWidth'],
+                 p['penmagnetWidth'], p['penmagnetWidth']]
+    lengths = np.where(k % 2 == 0, p['oddmagnetLength'], p['magnetLength'])
+    # one interMagnet between blocks and before the first, as in the script
+    inter = p['interMagnet']
+    top = halbach_cell(p['margin']+inter/2, lengths, sep+width/2, width, 0, inter/2,
+                       p['magnetType'])
+    return mirror_rows(np.concatenate([top, mirror_ends(top[:4], device_centre(p))]))
+
+
+def cell_table(p, ncell):
+    """Top and bottom row of the first ncell (2 or 4) blocks of a regular v6 cell at s = 0."""
+    k, inter = np.arange(ncell), p['interMagnet']
+    top = halbach_cell(inter/2, np.where(k % 2 == 0, p['oddmagnetLength'], p['magnetLength']),
+                       p['magnetSep']+p['magnetWidth']/2, p['magnetWidth'], 0, inter/2,
+                       p['magnetType'])
+    table = mirror_rows(top)
+    # rows interleaved per block, as the periodic model draws them
+    return table.reshape(2, ncell).T.ravel()
+
+
+def madx_table(p):
+    """MAD-X spec device of attempt2/3: numrepeats+1 cells, drift (odd) blocks between poles."""
+    k, inter = np.arange(4), p['interMagnet']
+    # one interMagnet between blocks and before the first, as in the scripts
+    top = halbach_cell(p['margin']+inter/2,
+                       np.where(k % 2 == 0, p['oddmagnetLength'], p['magnetLength']),
+                       p['magnetSep']+p['magnetWidth']/2, p['magnetWidth'], 0, inter/2,
+                       p['magnetType'])
+    return mirror_rows(repeat(top, p['og_thickness'], p['numrepeats']))
+
+
+def drift_end_table(p):
+    """v4 device: the MAD-X spec cells closed by one more drift block (magdir 0) at the exit."""
+    top = madx_table(p)
+    top = top[top['row'] > 0]
+    x = (p['numrepeats']+1)*p['og_thickness']+p['margin']+p['oddmagnetLength']/2
+    end = make_blocks(x, p['magnetSep']+p['magnetWidth']/2, p['oddmagnetLength'],
+                      p['magnetWidth'], 0, p['magnetType'])
+    return mirror_rows(np.concatenate([top, end]))
+
+
+def halbach_table(p):
+    """attempt1 device: square magnetThick blocks, cells og_thickness apart (0.2 air between)."""
+    T, inter = p['magnetThick'], p['interMagnet']
+    # one interMagnet between blocks, i.e. half of it on either side
+    top = halbach_cell(-1.5*T-1.5*inter, np.full(4, T), T/2+p['magnetSep'], T, 0, inter/2,
+                       p['magnetType'])
+    return mirror_rows(repeat(top, p['og_thickness'], p['numrepeats']))
+
+
+VARIANTS = {'attempt1': halbach_table, 'attempt2': madx_table, 'attempt3': madx_table,
+            'v4': drift_end_table, 'v6': onaxis_table}
+
+
+def variant_table(p):
+    """Block table of the design p (script_design or onaxis_design)."""
+    return VARIANTS[p.get('variant', 'v6')](p)
+
+
+def clip_s(table, smax):
+    """Blocks up to s = smax, a block straddling it cut short, those beyond dropped."""
+    table = table[table['cx']-table['length']/2 < smax].copy()
+    over = table['cx']+table['length']/2 > smax
+    length = smax-(table['cx'][over]-table['length'][over]/2)
+    table['length'][over] = length
+    table['cx'][over] = smax-length/2
+    return table
+
+
+def remanences(table):
+    """Br [T] per block from its material."""
+    Br = np.array([remanence(name) if MATERIALS[name]['H_c'] else 0.0
+                   for name in MATERIAL_NAMES])
+    return Br[table['material']]
+
+
+def overlaps(table, tol=1e-9):
+    """Index pairs (i, j), i < j, of blocks whose interiors overlap."""
+    x1, x2 = table['cx']-table['length']/2, table['cx']+table['length']/2
+    y1, y2 = table['cy']-table['width']/2, table['cy']+table['width']/2
+    scale = tol*max(1.0, np.abs(x1).max(initial=0), np.abs(x2).max(initial=0))
+    hit = ((np.minimum(x2[:, None], x2) - np.maximum(x1[:, None], x1) > scale)
+           & (np.minimum(y2[:, None], y2) - np.maximum(y1[:, None], y1) > scale))
+    i, j = np.nonzero(np.triu(hit, 1))
+    return np.column_stack([i, j])
+
+
+def validate(table):
+    """Raise ValueError for empty or negative sizes, wrong rows or overlapping blocks."""
+    if ((table['length'] <= 0) | (table['width'] <= 0)).any():
+        raise ValueError('blocks with non-positive size: %s'
+                         % np.nonzero((table['length'] <= 0) | (table['width'] <= 0))[0])
+    wrong = table['row'] != np.sign(table['cy'])
+    if wrong.any():
+        raise ValueError('row does not match the side of the axis for blocks %s'
+                         % np.nonzero(wrong)[0])
+    pairs = overlaps(table)
+    if len(pairs):
+        raise ValueError('%d overlapping block pairs, first %s' % (len(pairs), tuple(pairs[0])))
+    return table
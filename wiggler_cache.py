@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""
+Content-addressed cache of FEMM solutions.
+
+A model is keyed by the SHA-256 of its complete .FEM text, which already
+covers geometry, materials, mesh settings and boundary props, so two runs
+with the same key would produce the same solution. Each key gets its own
+directory holding model.FEM, the model.ans FEMM writes next to it and any
+field arrays extracted from it (as .npz). The least recently used entries
+are removed once the cache grows beyond max_bytes.
+
+Re-running with only plotting or readout changes then skips mi_analyze, and
+with cached field arrays does not need FEMM at all.
+"""
+
+import hashlib
+import os
+import shutil
+
+import numpy as np
+
+from wiggler_femfile import solve
+
+
+def model_key(model):
+    """Canonical hash of a FemModel."""
+    return hashlib.sha256(model.tostring().encode()).hexdigest()
+
+
+class SolutionCache:
+
+    def __init__(self, root='wiggler_cache', max_bytes=2*1024**3):
+        self.root = root
+        self.max_bytes = max_bytes
+        os.makedirs(root, exist_ok=True)
+
+    def entry(self, key):
+        return os.path.join(self.root, key)
+
+    def fem_file(self, key):
+        return os.path.join(self.entry(key), 'model.FEM')
+
+    def ans_file(self, key):
+        return os.path.join(self.entry(key), 'model.ans')
+
+    def _touch(self, key):
+        used = os.path.join(self.entry(key), 'used')
+        with open(used, 'a'):
+            pass
+        os.utime(used)
+
+    def has_solution(self, key):
+        return os.path.exists(self.ans_file(key))
+
+    def save_arrays(self, key, name, **arrays):
+        os.makedirs(self.entry(key), exist_ok=True)
+        np.savez(os.path.join(self.entry(key), name+'.npz'), **arrays)
+        self._touch(key)
+        self.evict(keep=key)
+
+    def load_arrays(self, key, name):
+        """Dict of arrays saved under name, or None."""
+        path = os.path.join(self.entry(key), name+'.npz')
+        if not os.path.exists(path):
+            return None
+        self._touch(key)
+        with np.load(path) as data:
+            return {k: data[k] for k in data.files}
+
+    def size(self, key):
+        entry = self.entry(key)
+        return sum(os.path.getsize(os.path.join(entry, f)) for f in os.listdir(entry))
+
+    def evict(self, keep=None):
+        """Remove least recently used entries until within max_bytes."""
+        entries = []
+        for key in os.listdir(self.root):
+            if not os.path.isdir(self.entry(key)):
+                continue
+            used = os.path.join(self.entry(key), 'used')
+            atime = os.path.getmtime(used) if os.path.exists(used) else 0
+            entries.append((atime, key, self.size(key)))
+        total = sum(size for _, _, size in entries)
+        for atime, key, size in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            shutil.rmtree(self.entry(key), ignore_errors=True)
+            total -= size
+
+
+def cached_solve(model, cache, femm=None, postprocess_only=False):
+    """Load the solution of model in FEMM, solving only on a cache miss.
+
+    On a hit the cached .ans is opened straight into the postprocessor
+    (mi_analyze is skipped). With postprocess_only a miss raises LookupError
+    instead of solving. Returns (key, hit).
+    """
+    if femm is None:
+        import femm
+    key = model_key(model)
+    if cache.has_solution(key):
+        femm.opendocument(cache.ans_file(key))
+        cache._touch(key)
+        return key, True
+    if postprocess_only:
+        raise LookupError('no cached solution for model %s' % key)
+    os.makedirs(cache.entry(key), exist_ok=True)
+    solve(model, cache.fem_file(key), femm)
+    cache._touch(key)
+    cache.evict(keep=key)
+    return key, False
+
+
+def cached_readout(model, cache, name, readout, femm=None):
+    """Field arrays called name for model, computed at most once.
+
+    readout(femm) is run against the loaded solution on a miss and must
+    return a dict of arrays. With the arrays cached FEMM is not touched;
+    otherwise it is started here unless a running femm module is given.
+    """
+    key = model_key(model)
+    arrays = cache.load_arrays(key, name)
+    if arrays is None:
+        if femm is None:
+            import femm
+            femm.openfemm()
+        cached_solve(model, cache, femm)
+        arrays = readout(femm)
+        cache.save_arrays(key, name, **arrays)
+    return arrays
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""
+Design parameters and material data for the pDR wiggler models.
+
+The defaults are the values used in wiggler_6_onaxis.py (tapered end magnets,
+MAD-X spec pole lengths); pass keyword overrides to change any of them.
+"""
+
+import numpy as np
+
+uo = 4 * np.pi * 10**-7  ## value of magnetic constant
+
+# Approximate grade data for the materials the scripts pull from the FEMM
+# library. Mu_x/Mu_y are relative permeabilities, H_c in A/m, Sigma in MS/m,
+# BH points as (B [T], H [A/m]). These are typical datasheet figures, NOT the
+# FEMM library entries: a model written from them (FemModel, ModelSession)
+# does not match one built with mi_getmaterial, and its fields differ by the
+# difference in Br and steel saturation. For exact agreement load the library
+# first, MATERIALS.update(read_materials('<femm>/bin/matlib.dat')).
+MATERIALS = {
+    'Air': dict(Mu_x=1, Mu_y=1, H_c=0, Sigma=0, BH=[]),
+    'N52': dict(Mu_x=1.05, Mu_y=1.05, H_c=1098966, Sigma=0.667, BH=[]),  # Br ~ 1.45 T
+    'SmCo32': dict(Mu_x=1.03, Mu_y=1.03, H_c=880755, Sigma=1.1, BH=[]),  # Br ~ 1.14 T
+    'N55': dict(Mu_x=1.05, Mu_y=1.05, H_c=1121700, Sigma=0.667, BH=[]),  # Br ~ 1.48 T
+    '1020 Steel': dict(Mu_x=1, Mu_y=1, H_c=0, Sigma=5.8,
+                       BH=[(0, 0), (0.2503, 238.7), (0.925, 795.8), (1.25, 1591.5),
+                           (1.39, 2387.3), (1.525, 3978.9), (1.71, 7957.7),
+                           (1.87, 15915.5), (1.955, 23873.2), (2.02, 39788.7),
+                           (2.11, 79577.5), (2.225, 159155), (2.43, 318310)]),
+}
+
+# c0 of the Asymptotic boundary does not follow the problem units, see the
+# c0_scale block in the scripts
+C0_SCALE = {'micrometers': 1000000.0, 'millimeters': 1000.0, 'centimeters': 100.0,
+            'meters': 1.0, 'inches': 1.0/0.0254, 'mils': 1000.0/0.0254}
+
+# metres per problem length unit
+UNIT_LENGTH = {'micrometers': 1e-6, 'millimeters': 1e-3, 'centimeters': 1e-2,
+               'meters': 1.0, 'inches': 0.0254, 'mils': 2.54e-5}
+
+
+_MATERIAL_KEYS = {'<mu_x>': 'Mu_x', '<mu_y>': 'Mu_y', '<h_c>': 'H_c', '<sigma>': 'Sigma'}
+
+
+def read_materials(filename):
+    """Material data from FEMM's matlib.dat or from a .FEM file FEMM saved.
+
+    Returns {name: dict} in the MATERIALS format.
+    """
+    with open(filename, errors='replace') as f:
+        lines = iter(f.read().splitlines())
+    materials = {}
+    for line in lines:
+        key, _, value = line.partition('=')
+        key, value = key.strip().lower(), value.strip()
+        if key == '<beginblock>':
+            name, m = None, dict(Mu_x=1, Mu_y=1, H_c=0, Sigma=0, BH=[])
+        elif key == '<blockname>':
+            name = value.strip('"')
+        elif key in _MATERIAL_KEYS:
+            m[_MATERIAL_KEYS[key]] = float(value)
+        elif key == '<bhpoints>':
+            m['BH'] = [tuple(float(v) for v in next(lines).split()[:2]) for _ in range(int(value))]
+        elif key == '<endblock>' and name is not None:
+            materials[name] = m
+    return materials
+
+
+def remanence(material):
+    """Remanent flux density Br [T] of a permanent magnet material."""
+    m = MATERIALS[material]
+    return uo*m['Mu_x']*m['H_c']
+
+
+def onaxis_design(**overrides):
+    """Parameter dict for the wiggler_6_onaxis.py device.
+
+    Names follow the script globals. The end/penultimate separations and
+    widths are derived from magnetSep/magnetWidth unless given explicitly.
+    """
+    p = dict(units='millimeters',
+             magnetLength=50.00191431900077,  # mm horizontally
+             Ldrift=30,  # mm
+             magnetSep=25,  # one half of separation between magnet layers vertically
+             magnetWidth=150,  # vertically
+             magnetType='N52',
+             steelThick=50,
+             interMagnet=0,
+             steelType='1020 Steel',
+             numrepeats=39,  # 41 total, but minus 2 for ends so 39 gives pDR spec
+             mess_size=0,  # set to zero for automatic
+             margin=0,
+             boundhoriz=700,
+             gapBand=0,  # half height of a separately meshed band along the axis, 0 for none
+             halfModel=False,  # mesh only y >= 0, see wiggler_femfile.build_onaxis_model
+             halfLength=False)  # mesh only up to the device centre
+    p.update(overrides)
+    p.setdefault('endmagnetSep', p['magnetSep']*2)  # quarter strength
+    p.setdefault('penmagnetSep', p['magnetSep']*2/np.sqrt(3))  # 3/4 strength
+    p.setdefault('endmagnetWidth', p['magnetWidth']-p['endmagnetSep']+p['magnetSep'])
+    p.setdefault('penmagnetWidth', p['magnetWidth']-p['penmagnetSep']+p['magnetSep'])
+    # mesh size per region, mess_size unless given (see wiggler_mesh)
+    p.setdefault('magnetMesh', p['mess_size'])
+    p.setdefault('steelMesh', p['mess_size'])
+    p.setdefault('airMesh', p['mess_size'])
+    p.setdefault('gapMesh', p['mess_size'])
+    p['oddmagnetLength'] = p['Ldrift']-2*p['interMagnet']
+    p['og_thickness'] = 2*p['magnetLength']+2*p['oddmagnetLength']+4*p['interMagnet']
+    p['lengthtotal'] = p['og_thickness']*(p['numrepeats']+3)+p['oddmagnetLength']
+    return p
+
+
+# globals of the earlier scripts, see script_design
+SCRIPTS = {
+    # Halbach example, square magnetThick blocks, magnetLength is the depth
+    'attempt1': dict(magnetLength=20.0, magnetThick=10.0, magnetSep=7, magnetType='N52',
+                     steelThick=1, interMagnet=0.7, steelType='1020 Steel', numrepeats=3),
+    # MAD-X spec pole and drift lengths
+    'attempt2': dict(magnetWidth=50, magnetLength=50.00191431900077, Ldrift=30, magnetSep=20,
+                     magnetType='N55', steelThick=30, interMagnet=5, steelType='1020 Steel',
+                     numrepeats=5, mess_size=0, margin=4, boundhoriz=100),
+    'attempt3': dict(magnetWidth=200, magnetLength=50.00191431900077, Ldrift=30, magnetSep=10,
+                     magnetType='N55', steelThick=50, interMagnet=0, steelType='1020 Steel',
+                     numrepeats=41, mess_size=0, margin=4, boundhoriz=700),
+    # MAD-X spec plus a closing drift block at the exit
+    'v4': dict(magnetWidth=200, magnetLength=50.00191431900077, Ldrift=30, magnetSep=25,
+               magnetType='N52', steelThick=50, interMagnet=0, steelType='1020 Steel',
+               numrepeats=41, mess_size=0, margin=1, boundhoriz=700),
+}
+
+
+def script_design(name, **overrides):
+    """Parameter dict of one of the script variants in SCRIPTS, or 'v6' (onaxis_design).
+
+    Adds the derived lengths the script computes (oddmagnetLength,
+    og_thickness, lengthtotal).
+    """
+    if name == 'v6':
+        return onaxis_design(**overrides)
+    p = dict(SCRIPTS[name], units='millimeters', variant=name)
+    p.update(overrides)
+    if name == 'attempt1':
+        p['og_thickness'] = 4*p['magnetThick']+4*p['interMagnet']+0.2
+        p['lengthtotal'] = p['og_thickness']*(p['numrepeats']+1)
+    else:
+        p['oddmagnetLength'] = p['Ldrift']-2*p['interMagnet']
+        p['og_thickness'] = 2*p['magnetLength']+2*p['oddmagnetLength']+4*p['interMagnet']
+        p['lengthtotal'] = p['og_thickness']*(p['numrepeats']+1)
+        if name == 'v4':
+            p['lengthtotal'] += p['oddmagnetLength']
+    return p
@@ -0,0 +1,334 @@
+# -*- coding: utf-8 -*-
+"""
+Geometry compiler that writes a complete FEMM magnetostatics .FEM file.
+
+Instead of driving FEMM node by node (mi_addnode, mi_drawline,
+mi_addblocklabel/mi_selectlabel/mi_setblockprop for every block) the whole
+model is collected in a FemModel, cleaned up the way FEMM does when drawing
+(coincident nodes merged, segments split at nodes lying on them, duplicate
+segments dropped) and written out in one go. FEMM is then only needed to
+open, mesh and solve the file. Nothing here imports femm until solve() is
+called, so the file contents can be checked on any machine.
+"""
+
+import numpy as np
+
+from wiggler_blocks import MATERIAL_NAMES, clip_s, device_centre, onaxis_table, validate
+from wiggler_design import MATERIALS, C0_SCALE, uo
+
+_TOL = 1e-9  # relative tolerance for merging nodes
+
+
+def _num(x):
+    # shortest repr that round-trips, so identical models give identical files
+    x = float(x)
+    if x == 0:
+        return '0'
+    if x == int(x) and abs(x) < 1e15:
+        return str(int(x))
+    return repr(x)
+
+
+class FemModel:
+    """In-memory FEMM magnetostatics model.
+
+    The method names and arguments follow the femm.mi_* calls they replace.
+    """
+
+    def __init__(self):
+        self.probdef()
+        self.materials = {}
+        self.boundprops = {}
+        self.nodes = []
+        self.segments = []
+        self.labels = []
+
+    def probdef(self, freq=0, units='millimeters', type='planar', precision=1E-8,
+                depth=1, minangle=30, acsolver=0):
+        self.freq, self.units, self.type = freq, units, type
+        self.precision, self.depth = precision, depth
+        self.minangle, self.acsolver = minangle, acsolver
+
+    def getmaterial(self, name):
+        if name not in MATERIALS:
+            raise KeyError('no material data for %r, add it to wiggler_design.MATERIALS' % name)
+        self.materials.setdefault(name, MATERIALS[name])
+
+    def addboundprop(self, name, A0=0, A1=0, A2=0, Phi=0, Mu=0, Sig=0, c0=0, c1=0, BdryFormat=0):
+        self.boundprops[name] = dict(BdryType=BdryFormat, A_0=A0, A_1=A1, A_2=A2, Phi=Phi,
+                                     c0=c0, c1=c1, Mu_ssd=Mu, Sigma_ssd=Sig)
+
+    def addnode(self, x, y, group=0):
+        self.nodes.append((x, y, group))
+
+    def drawline(self, x1, y1, x2, y2, boundary='', group=0):
+        self.segments.append((x1, y1, x2, y2, boundary, group))
+
+    def drawrectangle(self, x1, y1, x2, y2, group=0):
+        self.drawline(x1, y1, x2, y1, group=group)
+        self.drawline(x2, y1, x2, y2, group=group)
+        self.drawline(x2, y2, x1, y2, group=group)
+        self.drawline(x1, y2, x1, y1, group=group)
+
+    def drawblock(self, centerx, centery, length, width, group=0):
+        # same rectangle as drawMagnet/drawoddMagnet in the scripts
+        self.drawrectangle(centerx-length/2, centery-width/2,
+                           centerx+length/2, centery+width/2, group)
+
+    def addblocklabel(self, x, y, material, automesh=0, meshsize=0, magdir=0, group=0, turns=0):
+        # mi_addblocklabel + mi_setblockprop in one
+        self.getmaterial(material)
+        self.labels.append((x, y, material, automesh, meshsize, magdir, group, turns))
+
+    def addblocks(self, table, meshsize=0):
+        """drawblock + addblocklabel for every row of a wiggler_blocks table."""
+        x1, x2 = table['cx']-table['length']/2, table['cx']+table['length']/2
+        y1, y2 = table['cy']-table['width']/2, table['cy']+table['width']/2
+        corners = np.stack([x1, y1, x2, y1, x2, y2, x1, y2, x1, y1], axis=1)
+        sides = np.stack([corners[:, 2*k:2*k+4] for k in range(4)], axis=1).reshape(-1, 4)
+        groups = np.repeat(table['group'], 4).tolist()
+        self.segments += [tuple(side)+('', group) for side, group in zip(sides.tolist(), groups)]
+        for material in np.unique(table['material']):
+            self.getmaterial(MATERIAL_NAMES[material])
+        columns = [table[k].tolist() for k in ('cx', 'cy', 'material', 'magdir', 'group')]
+        self.labels += [(x, y, MATERIAL_NAMES[m], 0, meshsize, magdir, group, 0)
+                        for x, y, m, magdir, group in zip(*columns)]
+
+    def compile(self):
+        """Apply FEMM's drawing clean-up.
+
+        Returns (xy, groups, segments): node coordinates (n, 2), node groups
+        (n,) and a list of (n0, n1, boundary, group) segments.
+        """
+        segs = np.array([s[:4] for s in self.segments], dtype=float).reshape(-1, 4)
+        pts = np.concatenate([np.array([n[:2] for n in self.nodes], dtype=float).reshape(-1, 2),
+                              segs.reshape(-1, 2)])
+        grp = np.array([n[2] for n in self.nodes]+[s[5] for s in self.segments for _ in (0, 1)],
+                       dtype=int)
+        scale = max(1.0, np.abs(pts).max()) if len(pts) else 1.0
+        tol = scale*_TOL
+
+        # merge coincident nodes, keeping the order they were first drawn in
+        keys = np.round(pts/tol).astype(np.int64)
+        _, first, inverse = np.unique(keys, axis=0, return_index=True, return_inverse=True)
+        order = np.argsort(first)
+        rank = np.empty_like(order)
+        rank[order] = np.arange(len(order))
+        xy = pts[first[order]]
+        groups = grp[first[order]]
+        index = rank[inverse.ravel()]
+        ends = index[len(self.nodes):].reshape(-1, 2)
+
+        out = {}
+        chunk = max(1, 2**22//max(1, len(xy)))
+        for c in range(0, len(ends), chunk):
+            a, b = ends[c:c+chunk, 0], ends[c:c+chunk, 1]
+            p, d = xy[a], xy[b]-xy[a]
+            L2 = np.einsum('ij,ij->i', d, d)
+            L2[L2 == 0] = np.inf
+            rx = xy[None, :, 0]-p[:, None, 0]
+            ry = xy[None, :, 1]-p[:, None, 1]
+            t = (rx*d[:, None, 0]+ry*d[:, None, 1])/L2[:, None]
+            off = np.abs(rx*d[:, None, 1]-ry*d[:, None, 0])/np.sqrt(L2)[:, None]
+            inner = (off < 10*tol) & (t > _TOL) & (t < 1-_TOL)
+            for i in range(len(a)):
+                if a[i] == b[i]:
+                    continue
+                on = np.nonzero(inner[i])[0]
+                chain = [a[i]]+list(on[np.argsort(t[i, on])])+[b[i]]
+                boundary, group = self.segments[c+i][4:]
+                for n0, n1 in zip(chain[:-1], chain[1:]):
+                    key = (min(n0, n1), max(n0, n1))
+                    if key not in out or (boundary and not out[key][2]):
+                        out[key] = (n0, n1, boundary, group)
+        return xy, groups, list(out.values())
+
+    def tostring(self):
+        """The complete .FEM file as a string."""
+        xy, groups, segments = self.compile()
+        bnames = list(self.boundprops)
+        mnames = list(self.materials)
+        lines = ['[Format]      =  4.0',
+                 '[Frequency]   =  ' + _num(self.freq),
+                 '[Precision]   =  ' + _num(self.precision),
+                 '[MinAngle]    =  ' + _num(self.minangle),
+                 '[Depth]       =  ' + _num(self.depth),
+                 '[LengthUnits] =  ' + self.units,
+                 '[ProblemType] =  ' + self.type,
+                 '[Coordinates] =  cartesian',
+                 '[ACSolver]    =  ' + _num(self.acsolver),
+                 '[Comment]     =  ""',
+                 '[PointProps]  =  0',
+                 '[BdryProps]   =  %d' % len(bnames)]
+        for name in bnames:
+            lines.append('  <BeginBdry>')
+            lines.append('    <BdryName> = "%s"' % name)
+            for key, value in self.boundprops[name].items():
+                lines.append('    <%s> = %s' % (key, _num(value)))
+            lines.append('  <EndBdry>')
+        lines.append('[BlockProps]  =  %d' % len(mnames))
+        for name in mnames:
+            m = self.materials[name]
+            lines += ['  <BeginBlock>',
+                      '    <BlockName> = "%s"' % name,
+                      '    <Mu_x> = ' + _num(m['Mu_x']),
+                      '    <Mu_y> = ' + _num(m['Mu_y']),
+                      '    <H_c> = ' + _num(m['H_c']),
+                      '    <H_cAngle> = 0',
+                      '    <J_re> = 0',
+                      '    <J_im> = 0',
+                      '    <Sigma> = ' + _num(m['Sigma']),
+                      '    <d_lam> = 0',
+                      '    <Phi_h> = 0',
+                      '    <Phi_hx> = 0',
+                      '    <Phi_hy> = 0',
+                      '    <LamType> = 0',
+                      '    <LamFill> = 1',
+                      '    <NStrands> = 0',
+                      '    <WireD> = 0',
+                      '    <BHPoints> = %d' % len(m['BH'])]
+            lines += ['      %s\t%s' % (_num(B), _num(H)) for B, H in m['BH']]
+            lines.append('  <EndBlock>')
+        lines.append('[CircuitProps]  = 0')
+        lines.append('[NumPoints] = %d' % len(xy))
+        lines += ['%s\t%s\t0\t%d' % (_num(x), _num(y), g) for (x, y), g in zip(xy, groups)]
+        lines.append('[NumSegments] = %d' % len(segments))
+        # n0 n1 maxsidelength(-1 automatic) boundary hidden group
+        lines += ['%d\t%d\t-1\t%d\t0\t%d' % (n0, n1, bnames.index(b)+1 if b else 0, g)
+                  for n0, n1, b, g in segments]
+        lines.append('[NumArcSegments] = 0')
+        lines.append('[NumHoles] = 0')
+        lines.append('[NumBlockLabels] = %d' % len(self.labels))
+        # x y blocktype meshsize(-1 automatic) incircuit magdir group turns isexternal
+        for x, y, material, automesh, meshsize, magdir, group, turns in self.labels:
+            size = '-1' if automesh or meshsize <= 0 else _num(meshsize)
+            lines.append('%s\t%s\t%d\t%s\t0\t%s\t%d\t%d\t0'
+                         % (_num(x), _num(y), mnames.index(material)+1, size,
+                            _num(magdir), group, turns))
+        return '\n'.join(lines)+'\n'
+
+    def write(self, filename):
+        with open(filename, 'w', newline='\n') as f:
+            f.write(self.tostring())
+        return filename
+
+
+def solve(model, filename, femm=None):
+    """Write the model, then open, mesh and solve it in FEMM.
+
+    FEMM must already be running (femm.openfemm()). The solution is left
+    loaded for mo_* readout.
+    """
+    if femm is None:
+        import femm
+    model.write(filename)
+    femm.opendocument(filename)
+    femm.mi_analyze(0)
+    femm.mi_loadsolution()
+
+
+def add_boundprops(model, p):
+    # Asymptotic/Periodic/Antiperiodic as created in all the scripts
+    c0 = C0_SCALE[p['units']]/(2*uo*p['magnetLength'])
+    model.addboundprop("Asymptotic", 0, 0, 0, 0, 0, 0, c0, 0, 2)
+    model.addboundprop("Periodic", 0, 0, 0, 0, 0, 0, 0, 0, 4)
+    model.addboundprop("Antiperiodic", 0, 0, 0, 0, 0, 0, 0, 0, 5)
+
+
+def add_gap_band(model, p, x1, x2, sides=True, half=False):
+    """Mesh zone |y| < gapBand between x1 and x2 around the beam axis.
+
+    Only construction segments and an Air label (group 2) meshed with
+    gapMesh are added; sides=False leaves out the vertical edges when the
+    caller draws its own at x1 and x2. With half=True only 0 <= y < gapBand.
+    """
+    band = p['gapBand']
+    if band >= min(p['magnetSep'], p['endmagnetSep'], p['penmagnetSep']):
+        raise ValueError('gapBand %g must stay inside the magnet gap' % band)
+    low = 0 if half else -band
+    model.drawline(x1, band, x2, band)
+    if not half:
+        model.drawline(x1, -band, x2, -band)
+    if sides:
+        model.drawline(x1, low, x1, band)
+        model.drawline(x2, low, x2, band)
+    model.addblocklabel((x1+x2)/2, (low+band)/2, "Air", 0, p['gapMesh'], 0, 2, 0)
+
+
+def build_onaxis_model(p):
+    """FemModel of the wiggler_6_onaxis.py device (see wiggler_design).
+
+    The bottom row is the mirror image of the top row with magdir ->
+    180-magdir, so By is even and Bx odd in y and the field crosses y=0 at
+    right angles. With p['halfModel'] only y >= 0 is built and the midplane
+    gets a homogeneous Neumann condition (dA/dn = 0) instead.
+
+    The exit end is the entrance end mirrored about the device centre with
+    magdir -> -magdir, so By is odd and Bx even about the centre: By = 0 on
+    the centre plane and the field lines run along it, not across it. With
+    p['halfLength'] only s <= centre is built (the centre block cut in half)
+    and the centre plane gets the same dA/dn = 0 condition as the midplane.
+    Either mode halves the mesh; read the result out through
+    wiggler_readout.symmetric_readout.
+    """
+    magnetSep, magnetWidth, steelThick = p['magnetSep'], p['magnetWidth'], p['steelThick']
+    margin, boundhoriz = p['margin'], p['boundhoriz']
+    lengthtotal = p['lengthtotal']
+    half = p['halfModel']
+
+    model = FemModel()
+    model.probdef(0, p['units'], 'planar', 1E-8, magnetWidth)
+    model.getmaterial(p['magnetType'])
+    model.getmaterial(p['steelType'])
+    model.getmaterial('Air')
+    add_boundprops(model, p)
+
+    right = lengthtotal+2*margin
+    centre = device_centre(p)
+    end = centre if p['halfLength'] else right  # last s of the device in the model
+    xmax = centre if p['halfLength'] else right+boundhoriz
+    ymin = 0 if half else -4*magnetWidth
+    bottom = side = ''
+    if half:
+        # mixed condition with c0 = c1 = 0, i.e. dA/dn = 0 (unassigned edges are A = 0)
+        model.addboundprop("Midplane", 0, 0, 0, 0, 0, 0, 0, 0, 2)
+        bottom = "Midplane"
+    if p['halfLength']:
+        # Bx is even about the centre, so dA/dn = 0 there as well, not A = 0
+        model.addboundprop("Centre", 0, 0, 0, 0, 0, 0, 0, 0, 2)
+        side = "Centre"
+    model.drawline(-boundhoriz, ymin, xmax, ymin, bottom)
+    model.drawline(xmax, ymin, xmax, 4*magnetWidth, side)
+    model.drawline(xmax, 4*magnetWidth, -boundhoriz, 4*magnetWidth)
+    model.drawline(-boundhoriz, 4*magnetWidth, -boundhoriz, ymin)
+
+    blocks = validate(onaxis_table(p))
+    if half:
+        blocks = blocks[blocks['row'] > 0]
+    if p['halfLength']:
+        # the centre block (magdir 0 or 180) straddles the centre plane
+        blocks = clip_s(blocks, centre)
+    model.addblocks(blocks, p['magnetMesh'])
+
+    # steel sheets
+    if steelThick > 0:
+        inner = magnetSep+magnetWidth
+        model.drawrectangle(margin, inner, end, inner+steelThick)
+        model.addblocklabel(margin+p['interMagnet']+p['magnetLength'], inner+0.5*steelThick,
+                            p['steelType'], 0, p['steelMesh'], 0, 1, 0)
+        if not half:
+            model.drawrectangle(margin, -inner, end, -inner-steelThick)
+            model.addblocklabel(margin+p['interMagnet']+p['magnetLength'], -inner-0.5*steelThick,
+                                p['steelType'], 0, p['steelMesh'], 0, 1, 0)
+
+    # finer mesh where the beam is
+    if p['gapBand'] > 0:
+        add_gap_band(model, p, 0, end, half=half)
+
+    # surrounding air, left of the device (on axis unless that is the midplane)
+    model.addblocklabel(-boundhoriz/2, magnetWidth if half else 0, "Air", 0, p['airMesh'], 0, 1, 0)
+
+    #adding nodes to analyse through centre
+    model.addnode(0, 0)
+    model.addnode(end, 0)
+    return model
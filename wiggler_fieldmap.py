@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""
+2D field maps over the gap of the device.
+
+The commented-out mesh_lines in wiggler_5_readingout.py built a contour per
+grid row with mo_addcontour, wrote it with mo_makeplot to
+temp/contour_B.txt and read it back: a FEMM round-trip and a file per row,
+and unsigned |B| only. field_map instead hands the whole grid (or large
+chunks of it) to readout.getb, which evaluates all points in one batched
+request, and returns signed Bx, By arrays of shape (ny, ns). Points outside
+a mask, e.g. the circular region of mesh_lines, are not evaluated at all
+and come back as NaN.
+"""
+
+import numpy as np
+
+from wiggler_readout import FunctionReadout
+
+_CHUNK = 2**21  # points per readout request
+
+
+def gap_grid(p, ns=2000, ny=51, half_height=None):
+    """Sample coordinates over the full device length and the gap.
+
+    half_height defaults to magnetSep, so the outer rows lie on the pole
+    faces where By jumps; use 25 for the 50 mm diameter beam pipe. Returns
+    1D arrays s (ns,) and y (ny,).
+    """
+    if half_height is None:
+        half_height = p['magnetSep']
+    s = np.linspace(0, p['lengthtotal']+2*p['margin'], ns)
+    y = np.linspace(-half_height, half_height, ny)
+    return s, y
+
+
+def circle_mask(s, y, radius, centre=(0, 0)):
+    """(ny, ns) mask of the grid points inside a circle, as in mesh_lines."""
+    S, Y = np.meshgrid(s, y)
+    return (S-centre[0])**2+(Y-centre[1])**2 < radius**2
+
+
+def aperture_mask(s, y, radius):
+    """(ny, ns) mask of the grid points within radius of the axis (|y| < radius)."""
+    return np.broadcast_to(np.abs(np.asarray(y))[:, None] < radius, (len(y), len(s)))
+
+
+def field_map(readout, s, y, mask=None, chunk=_CHUNK):
+    """Signed (bx, by) of shape (ny, ns) on the grid s x y.
+
+    readout is a FemmReadout, FunctionReadout or anything with getb(x, y).
+    With a (ny, ns) boolean mask only the True points are evaluated, the
+    rest are NaN. Large grids are evaluated in chunks of chunk points.
+    """
+    s = np.asarray(s, dtype=float)
+    y = np.asarray(y, dtype=float)
+    shape = (len(y), len(s))
+    if mask is None:
+        index = np.arange(shape[0]*shape[1])
+    else:
+        index = np.flatnonzero(np.broadcast_to(mask, shape))
+    bx = np.full(shape, np.nan)
+    by = np.full(shape, np.nan)
+    for start in range(0, len(index), chunk):
+        i = index[start:start+chunk]
+        row, col = np.divmod(i, shape[1])
+        bx.flat[i], by.flat[i], _ = readout.getb(s[col], y[row])
+    return bx, by
+
+
+def analytic_field_map(p, s, y, mask=None, cutoff=None):
+    """field_map of the iron-free analytic model of the design p."""
+    from wiggler_analytic import field
+    from wiggler_blocks import variant_table
+
+    blocks = variant_table(p)
+    return field_map(FunctionReadout(lambda x, y: field(x, y, blocks, cutoff=cutoff)), s, y, mask)
+
+
+if __name__ == '__main__':
+    from wiggler_design import onaxis_design
+    from wiggler_headless import pyplot, show
+
+    p = onaxis_design()
+    s, y = gap_grid(p, 4000, 41, 25)
+    bx, by = analytic_field_map(p, s, y, aperture_mask(s, y, 25), cutoff=12*p['og_thickness'])
+    plt = pyplot()
+    plt.pcolormesh(s, y, by, shading='auto')
+    plt.colorbar(label='By [T]')
+    plt.xlabel('s [mm]')
+    plt.ylabel('y [mm]')
+    show('wiggler_fieldmap')
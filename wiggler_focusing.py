@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""
+Vertical focusing of the wiggler and its effect on the ring optics.
+
+"The wiggler will introduce a vertical focussing effect / beta-beat which
+must be compensated."
+
+A particle on the wiggle trajectory, x'(s) = -I1(s)/Brho, crosses the
+longitudinal field Bs off the midplane, which pulls it back towards it:
+
+    y'' = -k(s) y,    k(s) = x'(s) g(s)/Brho = -I1(s) g(s)/Brho^2
+
+with g = dBs/dy at y = 0. Without iron curl B = 0 gives g = dBy/ds on axis,
+so By(s) alone is enough and, integrating by parts, the integrated
+strength is K = int k ds = int (By/Brho)^2 ds, i.e. (B0/Brho)^2/2 per unit
+length of a sinusoidal field of peak B0. With a 2D map the gradient is
+fitted to the off-axis Bs rows instead (map_gradient), which also covers
+the pole geometry. The wiggler then acts as a thin lens of strength K
+(k = K/L as a quadrupole over its length), and with the vertical optics at
+the entrance (betay, alphay, fractional or full tune qy)
+
+    dQy = int beta k ds / 4pi,    max dbeta/beta = int beta k ds / (2|sin 2pi qy|)
+
+per wiggler; nwigglers in phase add up. As in wiggler_radiation every
+function broadcasts over leading axes, so stacked profiles of a sweep go in
+one call, and rank() orders the rows of wiggler_sweep.sweep, which carry
+int By^2 ds, by their lattice impact.
+
+    python wiggler_focusing.py [E_GeV]
+"""
+
+import sys
+
+import numpy as np
+
+from wiggler_design import UNIT_LENGTH
+from wiggler_radiation import _integral, ring_design
+from wiggler_trajectory import field_integrals, rigidity
+
+
+def map_gradient(y, bs, yfit=None):
+    """g(s) = dBs/dy at y = 0 from the rows of a (ny, ns) map of Bs.
+
+    Bs is odd in y about the midplane, so g y + c y^3 is fitted to the
+    rows with |y| <= yfit (default all) that are finite everywhere. Returns
+    g in T per problem length unit, shape (ns,).
+    """
+    y = np.asarray(y, dtype=float)
+    bs = np.asarray(bs, dtype=float)
+    rows = np.all(np.isfinite(bs), axis=-1) & (y != 0)
+    if yfit is not None:
+        rows &= np.abs(y) <= yfit
+    if rows.sum() < 2:
+        raise ValueError('need at least two finite off-axis rows, got %d' % rows.sum())
+    A = np.stack([y[rows], y[rows]**3], axis=1)
+    return np.linalg.lstsq(A, bs[rows], rcond=None)[0][0]
+
+
+def focusing_integrals(s, by, energy, units='millimeters', betay=10.0, alphay=0.0,
+                       gradient=None):
+    """Vertical focusing of one pass through the wiggler.
+
+    s is in the problem length unit and by in T, samples along the last
+    axis; gradient is dBs/dy [T per length unit] from map_gradient, by
+    default dBy/ds on axis. Returns a dict of arrays of shape by.shape[:-1]:
+    K [1/m], the equivalent thin-lens strength k = K/L [1/m^2], L [m] and
+    J = int beta k ds with beta(s) from the entrance optics.
+    """
+    s = np.asarray(s, dtype=float)
+    by = np.asarray(by, dtype=float)
+    i1, _ = field_integrals(s, by, units)
+    sm = s*UNIT_LENGTH[units]
+    sm = sm-sm[..., :1]
+    if gradient is not None:
+        g = np.asarray(gradient, dtype=float)/UNIT_LENGTH[units]
+    elif sm.ndim == 1:
+        g = np.gradient(by, sm, axis=-1)
+    else:
+        g = np.gradient(by, axis=-1)/np.gradient(sm, axis=-1)
+    brho = rigidity(energy)
+    k = -i1*g/brho**2
+    gammay = (1+alphay**2)/betay
+    beta = betay-2*alphay*sm+gammay*sm**2
+    sm = np.broadcast_to(sm, by.shape)
+    K = _integral(k, sm)
+    L = sm[..., -1]
+    return dict(K=K, k=K/L, L=L, J=_integral(beta*k, sm))
+
+
+def lattice_impact(ring, integrals):
+    """Tune shift and beta-beat of nwigglers wigglers of the given integrals.
+
+    Returns a dict (broadcast over the integrals' shape) with the focal
+    length f [m] of one wiggler, dqy and the peak relative beta-beat
+    beta_beat, the latter for all wigglers in phase (an upper bound).
+    """
+    n = ring['nwigglers']
+    dqy = n*integrals['J']/(4*np.pi)
+    beat = n*np.abs(integrals['J'])/(2*np.abs(np.sin(2*np.pi*ring['qy'])))
+    with np.errstate(divide='ignore'):
+        f = 1/np.asarray(integrals['K'], dtype=float)
+    return dict(integrals, f=f, dqy=dqy, beta_beat=beat)
+
+
+def focusing(s, by, ring=None, units='millimeters', gradient=None):
+    """Vertical focusing and lattice impact for one or many By(s) profiles."""
+    ring = ring_design() if ring is None else ring
+    integrals = focusing_integrals(s, by, ring['energy'], units, ring['betay'],
+                                   ring['alphay'], gradient)
+    return lattice_impact(ring, integrals)
+
+
+def rank(results, ring=None):
+    """Sweep rows with thin-lens K, dqy and beta_beat added, least impact first.
+
+    Uses the IB2 = int By^2 ds [T^2.m] column of wiggler_sweep, so K =
+    IB2/Brho^2 and J = betay*K at the entrance; rows without it (failed
+    cases) go last.
+    """
+    ring = ring_design() if ring is None else ring
+    ib2 = np.array([row.get('IB2', np.nan) for row in results], dtype=float)
+    K = ib2/rigidity(ring['energy'])**2
+    impact = lattice_impact(ring, dict(K=K, J=ring['betay']*K))
+    order = np.argsort(np.where(np.isfinite(K), np.abs(impact['dqy']), np.inf), kind='stable')
+    return [dict(results[i], K=K[i], dqy=impact['dqy'][i], beta_beat=impact['beta_beat'][i])
+            for i in order]
+
+
+if __name__ == '__main__':
+    from wiggler_analytic import onaxis_profile
+    from wiggler_design import onaxis_design
+    from wiggler_fieldmap import analytic_field_map
+
+    energy = float(sys.argv[1]) if len(sys.argv) > 1 else 1.54  # pDR energy
+    ring = ring_design(energy=energy)
+    p = onaxis_design()
+    s, bx, by = onaxis_profile(p, 25000)
+    y = np.linspace(-5, 5, 11)
+    bs, _ = analytic_field_map(p, s, y)
+    for name, gradient in (('on axis', None), ('field map', map_gradient(y, bs))):
+        result = focusing(s, by, ring, p['units'], gradient)
+        print('%-10s K = %.4g 1/m, k = %.4g 1/m^2, f = %.4g m, dQy = %.4g, dbeta/beta = %.3g'
+              % (name, result['K'], result['k'], result['f'], result['dqy'], result['beta_beat']))
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""
+Golden-file check of the .FEM writer, no FEMM needed.
+
+Builds a fixed set of models (short on-axis devices in every symmetry mode,
+with a gap band and with interMagnet spacing, and both periodic cells) and
+compares FemModel.tostring() byte for byte with the files in golden/. Any
+change to the geometry, the material data or the writer shows up here;
+after checking such a change in FEMM, rewrite the files with --update.
+
+    python wiggler_golden.py [--update]
+"""
+
+import os
+import sys
+
+from wiggler_design import onaxis_design
+from wiggler_femfile import build_onaxis_model
+from wiggler_periodic import build_cell_model
+
+GOLDEN = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'golden')
+
+short = dict(numrepeats=3)
+MODELS = {
+    'onaxis': lambda: build_onaxis_model(onaxis_design(**short)),
+    'half': lambda: build_onaxis_model(onaxis_design(halfModel=True, **short)),
+    'halflength': lambda: build_onaxis_model(onaxis_design(halfLength=True, **short)),
+    'quarter': lambda: build_onaxis_model(onaxis_design(halfModel=True, halfLength=True, **short)),
+    'gapband': lambda: build_onaxis_model(onaxis_design(gapBand=10, **short)),
+    'intermagnet': lambda: build_onaxis_model(onaxis_design(interMagnet=2, **short)),
+    'cell_antiperiodic': lambda: build_cell_model(onaxis_design(), True),
+    'cell_periodic': lambda: build_cell_model(onaxis_design(), False),
+}
+
+
+def check(update=False):
+    """Names of the models whose .FEM text differs from its golden file."""
+    failed = []
+    for name, build in MODELS.items():
+        filename = os.path.join(GOLDEN, name+'.FEM')
+        text = build().tostring().encode()
+        if update:
+            os.makedirs(GOLDEN, exist_ok=True)
+            with open(filename, 'wb') as f:
+                f.write(text)
+            continue
+        try:
+            with open(filename, 'rb') as f:
+                golden = f.read()
+        except FileNotFoundError:
+            golden = b''
+        if text != golden:
+            lines, old = text.splitlines(), golden.splitlines()
+            line = next((i for i, (a, b) in enumerate(zip(lines, old)) if a != b),
+                        min(len(lines), len(old)))
+            print('%s: differs from %s at line %d' % (name, filename, line+1))
+            failed.append(name)
+    return failed
+
+
+if __name__ == '__main__':
+    update = '--update' in sys.argv[1:]
+    failed = check(update)
+    if not update:
+        print('%d of %d models match' % (len(MODELS)-len(failed), len(MODELS)))
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+"""
+Headless batch mode: no FEMM window, no redraws, no blocking plots.
+
+Every script calls mi_hidegrid, mi_zoom and mi_refreshview, and the readout
+scripts end in plt.show(), which waits for the window to be closed. In
+headless mode
+
+  * femm is replaced by HeadlessFemm, which starts FEMM hidden
+    (openfemm(1)) and turns the view-only calls in VIEW_CALLS into no-ops;
+  * matplotlib is only imported when a figure is asked for (pyplot()), with
+    the non-interactive Agg backend, and show() saves the open figures as
+    PNG files (FIGURE_DIR, default the working directory) instead of
+    opening a window.
+
+Run any script headless with
+
+    python wiggler_headless.py [--stub] wiggler_6_onaxis.py [args]
+
+which installs the femm proxy before the script imports femm and saves the
+figures a script left open (plt.show() returns at once under Agg);
+--stub runs against femmprof.RecordingFemm instead of FEMM, in a
+temporary working directory (femmprof.stub_cwd), and --show runs the
+script with its windows, as it would on its own, but without blocking in
+plt.show(). The modules here call pyplot()/show(), which follow
+WIGGLER_HEADLESS=1 in the environment as well.
+
+    python wiggler_headless.py --bench [--femm] [script]
+
+times a script (default wiggler_6_onaxis.py) with --show and headless, both
+against the stub or, with --femm, against FEMM.
+"""
+
+import atexit
+import os
+import runpy
+import subprocess
+import sys
+import tempfile
+import time
+
+# femm functions that only change what the FEMM window shows
+VIEW_CALLS = frozenset([
+    'mi_hidegrid', 'mi_showgrid', 'mi_gridsnap', 'mi_setgrid', 'mi_zoom', 'mi_zoomin',
+    'mi_zoomout', 'mi_zoomnatural', 'mi_refreshview', 'mi_showmesh',
+    'mi_shownames', 'mi_minimize', 'mi_maximize', 'mi_restore', 'mi_resize',
+    'mo_zoom', 'mo_zoomin', 'mo_zoomout', 'mo_zoomnatural', 'mo_refreshview',
+    'mo_showdensityplot', 'mo_hidedensityplot', 'mo_showcontourplot', 'mo_hidecontourplot',
+    'mo_showvectorplot', 'mo_showmesh', 'mo_hidemesh', 'mo_showpoints', 'mo_hidepoints',
+    'mo_showgrid', 'mo_hidegrid', 'mo_gridsnap', 'mo_setgrid', 'mo_minimize', 'mo_maximize',
+    'mo_restore', 'mo_resize', 'main_minimize', 'main_maximize', 'main_restore', 'main_resize',
+])
+
+FIGURE_DIR = os.path.abspath(os.environ.get('WIGGLER_FIGURES', '.'))
+
+
+def enabled():
+    """Whether headless mode is on (WIGGLER_HEADLESS set and not 0)."""
+    return os.environ.get('WIGGLER_HEADLESS', '0') not in ('', '0')
+
+
+def _skip(*args, **kwargs):
+    pass
+
+
+class HeadlessFemm:
+    """femm module proxy that starts FEMM hidden and skips VIEW_CALLS."""
+
+    def __init__(self, femm=None):
+        if femm is None:
+            import femm
+        self._femm = femm
+
+    def openfemm(self, hide=1):
+        self._femm.openfemm(1)
+
+    def __getattr__(self, name):
+        if name in VIEW_CALLS:
+            return _skip
+        return getattr(self._femm, name)
+
+
+def pyplot():
+    """matplotlib.pyplot, imported now; with the Agg backend in headless mode."""
+    import matplotlib
+    if enabled():
+        matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    return plt
+
+
+_saved = [0]
+
+
+def save_figures(name='figure', directory=None):
+    """Save and close every open figure as name_<n>.png; returns the file names."""
+    if 'matplotlib.pyplot' not in sys.modules:
+        return []  # nothing was ever plotted
+    plt = sys.modules['matplotlib.pyplot']
+    directory = FIGURE_DIR if directory is None else directory
+    names = []
+    for number in plt.get_fignums():
+        _saved[0] += 1
+        filename = os.path.join(directory, '%s_%d.png' % (name, _saved[0]))
+        plt.figure(number).savefig(filename)
+        names.append(filename)
+    plt.close('all')
+    return names
+
+
+def show(name='figure'):
+    """plt.show(), or save_figures(name) in headless mode."""
+    if enabled():
+        return save_figures(name)
+    pyplot().show()
+
+
+def install(femm=None):
+    """Switch the process to headless mode.
+
+    Puts a HeadlessFemm in sys.modules['femm'] (so later "import femm" gets
+    it), selects Agg for when matplotlib is imported and saves the figures
+    still open at exit.
+    """
+    os.environ['WIGGLER_HEADLESS'] = '1'
+    os.environ['MPLBACKEND'] = 'Agg'
+    proxy = HeadlessFemm(femm)
+    sys.modules['femm'] = proxy
+    atexit.register(save_figures)
+    return proxy
+
+
+def run_script(script, args=(), femm=None, headless=True):
+    """Run a script headless in this process, figures named after it.
+
+    With headless=False the script runs as it would on its own, with femm
+    (if given) unwrapped and the default backend, except that matplotlib is
+    put in interactive mode so that plt.show() draws the windows and
+    returns instead of waiting for them to be closed.
+    """
+    if headless:
+        install(femm)
+        name = os.path.splitext(os.path.basename(script))[0]
+        atexit.register(save_figures, name)  # runs before the generic one
+    else:
+        if femm is not None:
+            sys.modules['femm'] = femm
+        try:
+            import matplotlib
+            matplotlib.interactive(True)
+        except ImportError:
+            pass  # the script fails on its own import, if it plots at all
+    sys.argv = [script]+list(args)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(script)))
+    runpy.run_path(script, run_name='__main__')
+
+
+def _best(command, env, repeat, cwd=None):
+    times = []
+    for _ in range(repeat):
+        t = time.perf_counter()
+        done = subprocess.run(command, env=env, cwd=cwd, stdout=subprocess.DEVNULL,
+                              stderr=subprocess.PIPE)
+        times.append(time.perf_counter()-t)
+        if done.returncode:
+            return None
+    return min(times)
+
+
+def benchmark(script=None, stub=True, repeat=3):
+    """Seconds to run a wiggler script interactive and headless.
+
+    Each run is a fresh interpreter running the script through run_script
+    (python wiggler_headless.py [--show] [--stub] script), so the startup,
+    the matplotlib backend, FEMM and its view calls all count; interactive
+    is --show, headless the default. script defaults to wiggler_6_onaxis.py.
+    With stub the runs use femmprof.RecordingFemm, which leaves only the
+    Python and matplotlib side to compare; stub=False drives real FEMM.
+    None where a run failed (e.g. no matplotlib or no FEMM).
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    script = os.path.abspath(script or os.path.join(here, 'wiggler_6_onaxis.py'))
+    env = {k: v for k, v in os.environ.items() if k not in ('MPLBACKEND', 'WIGGLER_HEADLESS')}
+    result = {}
+    with tempfile.TemporaryDirectory(prefix='wiggler_bench_') as tmp:
+        env['WIGGLER_FIGURES'] = tmp
+        for mode, flags in (('interactive', ['--show']), ('headless', [])):
+            command = ([sys.executable, os.path.join(here, 'wiggler_headless.py')]+flags
+                       + (['--stub'] if stub else [])+[script])
+            result[mode] = _best(command, env, repeat, cwd=tmp)
+    return result
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    if args[:1] == ['--bench']:
+        scripts = [a for a in args[1:] if a != '--femm']
+        result = benchmark(scripts[0] if scripts else None, stub='--femm' not in args)
+        for key, value in result.items():
+            print('%-12s %s' % (key, 'n/a' if value is None else '%.3f s' % value))
+        sys.exit(0)
+    headless = args[:1] != ['--show']
+    if not headless:
+        args = args[1:]
+    if args[:1] == ['--stub'] and len(args) > 1:
+        from femmprof import RecordingFemm, stub_cwd
+        script = os.path.abspath(args[1])
+        with stub_cwd():
+            run_script(script, args[2:], RecordingFemm(), headless)
+    elif args:
+        run_script(args[0], args[1:], headless=headless)
+    else:
+        print(__doc__)
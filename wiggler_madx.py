@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+MAD-X export of the computed wiggler field.
+
+The scripts carry the lattice spec as comments (B2..B5 RBENDs of
+ANGLEB2 = 0.0175 rad, WDRIFT of 0.03 m, WIGGLER: LINE=(21*WIGGLER_CELL)).
+Here the other direction is covered: the device is cut into nslices equal
+slices, each slice gets the bend angle of the field it contains,
+
+    angle_i = int_slice By ds / Brho
+
+(positive By bends towards -x, a positive MAD-X angle), and the slices are
+written as a MAD-X SEQUENCE, either as thick SBENDs or as thin MULTIPOLE
+kicks at the slice centres. The tapered end poles are simply part of the
+profile.
+
+The pole faces are square to the straight device axis, not to the wiggling
+orbit, and that is where the wiggler's vertical focusing int (By/Brho)^2 ds
+comes from. A thick slice therefore gets the edge angles of a rectangular
+magnet entered at the local orbit angle phi(s) = I1(s)/Brho, E1 = -phi at
+its entrance and E2 = phi at its exit (E1 = E2 = angle/2 for one symmetric
+slice, the RBEND), so its edges focus vertically by angle^2/L and cancel
+the horizontal body focusing. A thin kick keeps the reference straight, so
+each is followed by a zero-length MATRIX with just that vertical focusing. Slice angles come from the cumulative field integral interpolated
+at the slice edges. They are formatted and written a chunk at a time, so
+10^5 slices take well under a second and are never all held as text.
+
+    python wiggler_madx.py [nslices] [thin]
+"""
+
+import sys
+
+import numpy as np
+
+from wiggler_design import UNIT_LENGTH
+from wiggler_trajectory import cumtrapz, field_integrals, rigidity
+
+_CHUNK = 2**16  # slices formatted per write
+
+
+def slice_angles(s, by, edges, energy=1.54, units='millimeters'):
+    """Bend angle [rad] of the slices between consecutive edges (problem units)."""
+    i1, i2 = field_integrals(s, by, units)
+    return np.diff(np.interp(edges, s, i1))/rigidity(energy)
+
+
+def write_madx(filename, s, by, nslices, energy=1.54, units='millimeters', thin=False,
+               name='WIGGLER', prefix='WS', chunk=_CHUNK):
+    """Write By(s) as a MAD-X sequence of nslices bend slices.
+
+    s is in the problem length unit. Thick slices are SBENDs of length
+    L/nslices with edge angles from the orbit angle; thin slices are
+    MULTIPOLEs with KNL={angle} at the slice centres plus a MATRIX with the
+    vertical focusing, the drifts in between being implied by the sequence.
+    Returns the slice angles' sum, i.e. the exit angle of the design orbit
+    with the sign flipped.
+    """
+    s = np.asarray(s, dtype=float)
+    scale = UNIT_LENGTH[units]
+    i1, i2 = field_integrals(s, by, units)
+    brho = rigidity(energy)
+    length = (s[-1]-s[0])*scale
+    ds = length/nslices
+    total = 0.0
+    with open(filename, 'w', newline='\n') as f:
+        f.write('! %s: %d %s slices of the computed field, E = %.6g GeV, Brho = %.10g T.m\n'
+                % (name, nslices, 'thin' if thin else 'thick', energy, brho))
+        f.write('! exit field integrals I1 = %.6g T.m, I2 = %.6g T.m^2\n' % (i1[-1], i2[-1]))
+        f.write('! vertical focusing int (By/Brho)^2 ds = %.6g 1/m\n'
+                % (cumtrapz(np.square(by/brho), s*scale)[-1]))
+        f.write('%s: SEQUENCE, L = %.17g, REFER = ENTRY;\n' % (name, length))
+        for start in range(0, nslices, chunk):
+            k = np.arange(start, min(start+chunk, nslices)+1)
+            edges = s[0]+(s[-1]-s[0])*k/nslices
+            phi = np.interp(edges, s, i1)/brho
+            angle = np.diff(phi)
+            total += angle.sum()
+            at = (k[:-1]+0.5)*ds if thin else k[:-1]*ds
+            if thin:
+                lines = ['%s%d: MULTIPOLE, KNL = {%.17g}, AT = %.17g;\n'
+                         '%sV%d: MATRIX, L = 0, RM11 = 1, RM22 = 1, RM33 = 1, RM44 = 1, RM55 = 1,'
+                         ' RM66 = 1, RM43 = %.17g, AT = %.17g;\n'
+                         % (prefix, i, a, x, prefix, i, -a*a/ds, x)
+                         for i, a, x in zip(k, angle, at)]
+            else:
+                lines = ['%s%d: SBEND, L = %.17g, ANGLE = %.17g, E1 = %.17g, E2 = %.17g,'
+                         ' AT = %.17g;\n' % (prefix, i, ds, a, -e1, e2, x)
+                         for i, a, e1, e2, x in zip(k, angle, phi[:-1], phi[1:], at)]
+            f.writelines(lines)
+        f.write('ENDSEQUENCE;\n')
+    return total
+
+
+if __name__ == '__main__':
+    from wiggler_analytic import onaxis_profile
+    from wiggler_design import onaxis_design
+
+    nslices = int(float(sys.argv[1])) if len(sys.argv) > 1 else 1000
+    thin = len(sys.argv) > 2 and sys.argv[2] == 'thin'
+    p = onaxis_design()
+    s, bx, by = onaxis_profile(p, 25000)
+    print('total angle', write_madx('wiggler_sliced.madx', s, by, nslices, units=p['units'], thin=thin))
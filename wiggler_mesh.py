@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""
+Mesh convergence study and mesh size selection.
+
+All scripts solve with mess_size = 0 (automatic) everywhere, and how far the
+peak field and the field integrals move with the mesh is unknown. Here the
+mesh size of one region at a time (magnets, steel, air) is stepped down a
+ladder while the others are held at their finest size. Every case is
+solved through the sweep machinery and the element count, solve time, peak
+By and field integrals are recorded. Per region the coarsest size whose
+results agree with the all-finest reference within tolerance is selected,
+and the combination is checked with one more solve.
+
+save_mesh_defaults() stores the selection in wiggler_mesh.json. A sweep
+only uses it when asked to, sweep(cases, mesh='wiggler_mesh.json') or
+mesh=mesh_defaults(filename), and then applies it to every case unless the
+case overrides it.
+
+zone_benchmark() compares uniform meshes with the zoned one (fine band
+along the axis, see gapBand in wiggler_design) at equal on-axis accuracy.
+
+    python wiggler_mesh.py   (runs both with FEMM and saves the selection)
+"""
+
+import json
+
+from wiggler_design import onaxis_design
+from wiggler_sweep import femm_solver, sweep
+
+MESH_FILE = 'wiggler_mesh.json'
+
+# onaxis_design key of each region's mesh size; the gap band only exists
+# with gapBand > 0
+REGIONS = {'gap': 'gapMesh', 'magnet': 'magnetMesh', 'steel': 'steelMesh', 'air': 'airMesh'}
+
+# mesh sizes [mm] from coarse to fine, 0 being FEMM's automatic choice
+LADDER = {'gap': (0, 2, 1, 0.5),
+          'magnet': (0, 10, 5, 2.5, 1.25),
+          'steel': (0, 20, 10, 5),
+          'air': (0, 50, 20, 10)}
+
+# fine where the beam is, medium in the magnets, coarse elsewhere
+ZONES = dict(gapBand=20, gapMesh=1, magnetMesh=5, steelMesh=20, airMesh=0)
+
+# peak_By relative, I1 in T.m, I2 in T.m^2
+TOLERANCE = dict(peak_By=1e-3, I1=1e-5, I2=1e-5)
+
+
+def mesh_defaults(filename):
+    """Mesh settings saved by save_mesh_defaults as onaxis_design overrides."""
+    with open(filename) as f:
+        return json.load(f)['mesh']
+
+
+def save_mesh_defaults(study, filename=MESH_FILE):
+    """Save the selection of a mesh_study() (and its evidence) as the sweep default."""
+    with open(filename, 'w') as f:
+        json.dump(dict(mesh=study['mesh'], tolerance=study['tolerance'],
+                       within=study['within'], check=study['check'],
+                       reference=study['reference']), f, indent=1, default=float)
+    return filename
+
+
+def agrees(row, reference, tolerance=TOLERANCE):
+    """Whether a sweep row matches the reference row within tolerance."""
+    if row['status'] != 'ok':
+        return False
+    return (abs(row['peak_By']-reference['peak_By']) <= tolerance['peak_By']*abs(reference['peak_By'])
+            and abs(row['I1']-reference['I1']) <= tolerance['I1']
+            and abs(row['I2']-reference['I2']) <= tolerance['I2'])
+
+
+def mesh_study(design=None, ladder=LADDER, solver=femm_solver, tolerance=TOLERANCE,
+               workers=None, timeout=None, numpoints=25000, verbose=False):
+    """Solve the ladder, select the coarsest agreeing size per region.
+
+    design holds onaxis_design overrides of the device studied. Returns a
+    dict with all sweep rows, the reference row, the selected mesh
+    overrides, the check row of the selection and whether it agrees.
+    """
+    design = dict(design or {})
+    if not onaxis_design(**design)['gapBand']:
+        ladder = {region: sizes for region, sizes in ladder.items() if region != 'gap'}
+    finest = {REGIONS[region]: sizes[-1] for region, sizes in ladder.items()}
+    cases = [dict(design, **finest)]
+    which = [(None, '')]
+    for region, sizes in ladder.items():
+        for size in sizes[:-1]:
+            cases.append(dict(design, **dict(finest, **{REGIONS[region]: size})))
+            which.append((region, size))
+    rows = sweep(cases, solver, workers, timeout, numpoints, verbose=verbose, mesh={})
+    reference = rows[0]
+    if reference['status'] != 'ok':
+        raise RuntimeError('reference solve failed: %s' % reference['error'])
+    for row, (region, size) in zip(rows, which):
+        row['region'], row['size'] = region, size
+
+    mesh = {}
+    for region, sizes in ladder.items():
+        mesh[REGIONS[region]] = sizes[-1]
+        for row in rows:
+            if row['region'] == region and agrees(row, reference, tolerance):
+                mesh[REGIONS[region]] = row['size']
+                break  # rows are in ladder order, coarse first
+    check = sweep([dict(design, **mesh)], solver, 1, timeout, numpoints, mesh={})[0]
+    return dict(rows=rows, reference=reference, mesh=mesh, check=check,
+                within=agrees(check, reference, tolerance), tolerance=tolerance)
+
+
+def zone_benchmark(design=None, uniform=(0, 5, 2.5, 1.25), zones=ZONES, solver=femm_solver,
+                   tolerance=TOLERANCE, workers=None, timeout=None, numpoints=25000):
+    """Uniform mesh sizes against the zoned mesh, all against the finest uniform.
+
+    Returns sweep rows (labelled by region 'uniform'/'zoned' and size) with
+    an 'agrees' column comparing each on-axis result to the finest uniform
+    mesh within tolerance.
+    """
+    design = dict(design or {})
+    cases = [dict(design, mess_size=size, magnetMesh=size, steelMesh=size, airMesh=size)
+             for size in uniform]
+    cases.append(dict(design, **zones))
+    rows = sweep(cases, solver, workers, timeout, numpoints, mesh={})
+    reference = rows[len(uniform)-1]
+    for row, size in zip(rows, list(uniform)+['']):
+        row['region'] = 'uniform' if size != '' else 'zoned'
+        row['size'] = size
+        row['agrees'] = agrees(row, reference, tolerance)
+    return rows
+
+
+def study_table(study):
+    """Printable table of a mesh_study()."""
+    lines = ['%8s %8s %10s %10s %12s %12s %12s' % ('region', 'size', 'elements', 'time [s]',
+                                                   'peak_By', 'I1', 'I2')]
+    for row in study['rows']+[dict(study['check'], region=study['check'].get('region', 'chosen'),
+                                   size='')]:
+        lines.append('%8s %8s %10s %10.2f %12.6g %12.4g %12.4g'
+                     % (row.get('region') or 'finest', row.get('size', ''),
+                        row.get('elements', ''), row['time'], row['peak_By'], row['I1'], row['I2']))
+    lines.append('selected %s (%s)' % (study['mesh'], 'agrees' if study['within'] else 'DOES NOT agree'))
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    rows = zone_benchmark()
+    print(study_table(dict(rows=rows[:-1], check=rows[-1], mesh=ZONES, within=rows[-1]['agrees'])))
+    study = mesh_study(ZONES, verbose=True)
+    print(study_table(study))
+    if study['within']:
+        print(save_mesh_defaults(study))
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+"""
+Multipole content and good-field region around every pole.
+
+"Also the width of the poles should be sufficient to get a good field
+region throughout the beam pipe." (currently a 50 mm diameter beam pipe)
+
+In the planar model the field lies in the (s, y) plane and is uniform
+out of plane, so By + i*Bs is an analytic function of z = (s - s_pole) + i*y
+and can be expanded about every pole centre as
+
+    By + i*Bs = sum_n (B_n + i*A_n) * (z/r0)^(n-1)
+
+with normal B_n and skew A_n coefficients (n = 1 dipole, 3 the cosh-like
+roll-off of a periodic field). They are found by an FFT of the field
+sampled on a circle around each pole and, independently, by a least
+squares fit along a vertical line through it. All circles and all lines
+are evaluated in one batched readout each, from FEMM, the analytic model or
+a cached field map (wiggler_readout.GridReadout).
+
+The period itself puts cos(k z) = 1 - (k z)^2/2 + ... into every pole, b3 =
+-(k r0)^2/2 alone being ~0.2 at r0 = 20 mm, so field quality is measured
+against the ideal periodic field instead of a pure dipole: the field
+around the pole nearest the device centre, which the long device repeats
+every period. The good-field radius of a pole is the largest radius at
+which its multipoles stay within a relative tolerance (1e-3 as in
+mesh_lines) of the ideal ones scaled to its dipole. good_field_profile
+does the same along the whole device, from vertical lines of samples
+compared with the ideal period repeated along s.
+
+The horizontal good-field width (the out-of-plane pole width) is not in a
+2D model at all.
+"""
+
+import numpy as np
+
+
+def pole_centres(p):
+    """s of the vertically magnetised (magdir +-90) top-row blocks, i.e. the poles."""
+    from wiggler_blocks import variant_table
+
+    blocks = variant_table(p)
+    return blocks['cx'][(blocks['row'] > 0) & (blocks['magdir'] % 180 == 90)]
+
+
+def circle_multipoles(readout, centres, radius, nterms=10, npoints=64, r0=None, y0=0):
+    """(B, A), each (npoles, nterms), from an FFT of the field on circles.
+
+    B[:, n-1] and A[:, n-1] are the normal and skew coefficients of order n
+    in T at reference radius r0 (default radius).
+    """
+    centres = np.atleast_1d(np.asarray(centres, dtype=float))
+    r0 = radius if r0 is None else r0
+    theta = 2*np.pi*np.arange(npoints)/npoints
+    bx, by, _ = readout.getb(centres[:, None]+radius*np.cos(theta),
+                             y0+radius*np.sin(theta))
+    c = np.fft.fft(by+1j*bx, axis=1)[:, :nterms]/npoints
+    c *= (r0/radius)**np.arange(nterms)
+    return c.real, c.imag
+
+
+def line_multipoles(readout, centres, half_length, nterms=6, npoints=41, r0=None, y0=0):
+    """(B, A), each (npoles, nterms), from a least squares fit on vertical lines.
+
+    The lines run from y0-half_length to y0+half_length through every
+    centre. One fit solves all poles at once (one right hand side each).
+    """
+    centres = np.atleast_1d(np.asarray(centres, dtype=float))
+    r0 = half_length if r0 is None else r0
+    y = np.linspace(-half_length, half_length, npoints)
+    bx, by, _ = readout.getb(centres[:, None], y0+y)
+    M = (1j*y[:, None]/r0)**np.arange(nterms)
+    c = np.linalg.lstsq(M, (by+1j*bx).T, rcond=None)[0].T
+    return c.real, c.imag
+
+
+def good_field_radius(B, A, r0, tol=1e-3, rmax=None, nr=400, reference=None):
+    """Largest radius per pole where the field is within tol*|dipole| of the ideal.
+
+    reference holds the (nterms,) complex coefficients B_n + i*A_n of the
+    ideal field at a pole, scaled to each pole's dipole; by default a pure
+    dipole, so every non-dipole term counts. Uses the bound
+    sum_{n>=2} |C_n - ideal_n| (r/r0)^(n-1), evaluated on nr radii up to
+    rmax (default r0). Returns an array over poles; 0 if even the smallest
+    radius fails.
+    """
+    C = np.asarray(B)+1j*np.asarray(A)
+    dipole = C[:, :1]
+    if reference is not None:
+        reference = np.asarray(reference)
+        C = C-dipole*reference/reference[0]
+    rmax = r0 if rmax is None else rmax
+    r = np.linspace(0, rmax, nr+1)[1:]
+    powers = (r[:, None]/r0)**np.arange(1, C.shape[1])
+    deviation = np.abs(C[:, 1:]) @ powers.T/np.abs(dipole)
+    ok = np.cumprod(deviation <= tol, axis=1).sum(axis=1)
+    return np.where(ok > 0, r[np.maximum(ok-1, 0)], 0.0)
+
+
+def reference_pole(s):
+    """Index of the pole nearest the middle of the device, the ideal period."""
+    return int(np.argmin(np.abs(s-(s.min()+s.max())/2)))
+
+
+def pole_analysis(readout, p, radius=20, tol=1e-3, nterms=10, npoints=64):
+    """Multipoles and good-field radius of every pole of the design p.
+
+    radius (problem units) must keep the circles inside the gap, i.e. below
+    magnetSep. Returns a dict with the pole centres s, the circle (B, A) and
+    line (line_B, line_A) coefficients at r0 = radius, the index ref of the
+    reference pole and r_good per pole, measured from the reference pole's
+    multipoles.
+    """
+    s = pole_centres(p)
+    B, A = circle_multipoles(readout, s, radius, nterms, npoints)
+    line_B, line_A = line_multipoles(readout, s, radius, min(nterms, 6))
+    ref = reference_pole(s)
+    return dict(s=s, B=B, A=A, line_B=line_B, line_A=line_A, r0=radius, ref=ref,
+                r_good=good_field_radius(B, A, radius, tol, reference=B[ref]+1j*A[ref]))
+
+
+def good_field_profile(readout, p, s=None, radius=20, tol=1e-3, ny=41):
+    """Good-field half height along the device.
+
+    Samples the field on vertical lines |y| <= radius at every s (default
+    2001 points over the device) and, in the same readout, the ideal field:
+    the period around the reference pole repeated along s. Returns (s,
+    r_good, deviation) with deviation (ns, ny) = |B - B_ideal| over the peak
+    on-axis By of the ideal period and r_good the largest |y| up to which it
+    stays within tol.
+    """
+    poles = pole_centres(p)
+    centre = poles[reference_pole(poles)]
+    period = p['og_thickness']
+    if s is None:
+        s = np.linspace(0, p['lengthtotal']+2*p['margin'], 2001)
+    s = np.asarray(s, dtype=float)
+    y = np.linspace(-radius, radius, ny)
+    ideal = centre+(s-centre+period/2) % period-period/2
+    bx, by, _ = readout.getb(np.concatenate([s, ideal])[:, None], y)
+    b = by+1j*bx
+    peak = np.abs(by[len(s):, np.argmin(np.abs(y))]).max()
+    deviation = np.abs(b[:len(s)]-b[len(s):])/peak
+    order = np.argsort(np.abs(y), kind='stable')
+    ok = np.cumprod(deviation[:, order] <= tol, axis=1).sum(axis=1)
+    r_good = np.where(ok > 0, np.abs(y[order])[np.maximum(ok-1, 0)], 0.0)
+    return s, r_good, deviation
+
+
+if __name__ == '__main__':
+    import time
+    from wiggler_analytic import field
+    from wiggler_blocks import onaxis_table
+    from wiggler_design import onaxis_design
+    from wiggler_readout import FunctionReadout
+
+    p = onaxis_design()
+    blocks = onaxis_table(p)
+    readout = FunctionReadout(lambda x, y: field(x, y, blocks))
+    t = time.perf_counter()
+    result = pole_analysis(readout, p)
+    print('%d poles in %.3f s' % (len(result['s']), time.perf_counter()-t))
+    print('%10s %10s %12s %12s %10s' % ('s [mm]', 'B1 [T]', 'b3 [1e-4]', 'a2 [1e-4]', 'r_good'))
+    for s, B, A, r in zip(result['s'], result['B'], result['A'], result['r_good']):
+        print('%10.2f %10.4f %12.2f %12.2f %10.3f' % (s, B[0], 1e4*B[2]/B[0], 1e4*A[1]/B[0], r))
+    s, r_good, _ = good_field_profile(readout, p)
+    good = s[r_good == r_good.max()]
+    print('along the device: |y| <= %g mm within 1e-3 of the periodic field for s = %.1f .. %.1f mm'
+          ' (%.0f%% of the samples)' % (r_good.max(), good.min(), good.max(),
+                                       100*len(good)/len(s)))
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+Bulk parser for FEMM text output (mo_makeplot files, readout results).
+
+Read_Two_Column_File builds Python lists one line at a time. read_columns
+memory-maps the file and skips any header; plain whitespace separated data
+then goes through np.loadtxt's C parser, the fastest bulk path measured
+(bench_parse.py). Files written with a decimal comma or semicolons, or with
+stray text between the data, are converted in large newline aligned chunks
+straight into a preallocated float64 array instead. It handles any number
+of columns (x, B or x, Bx, By, |B| ...), tabs or spaces and Windows line
+endings.
+"""
+
+import mmap
+import re
+import warnings
+
+import numpy as np
+
+_CHUNK = 2**24  # bytes converted per step
+_NUMBER = re.compile(rb'^\s*[-+]?(\d|\.\d|nan|inf)', re.IGNORECASE)
+
+
+def _data_start(buf):
+    # offset of the first line that starts with a number
+    pos = 0
+    while pos < len(buf):
+        end = buf.find(b'\n', pos)
+        end = len(buf) if end < 0 else end+1
+        if _NUMBER.match(buf[pos:end]):
+            return pos
+        pos = end
+    return len(buf)
+
+
+def _tolerant(chunk, comma):
+    # line by line for chunks with stray text (repeated headers, footers)
+    values = []
+    for line in chunk.splitlines():
+        if comma:
+            line = line.replace(b',', b'.')
+        try:
+            values.append([float(v) for v in line.replace(b';', b' ').split()])
+        except ValueError:
+            continue
+    return values
+
+
+def read_columns(file_name, ncols=None, chunk_bytes=_CHUNK):
+    """Numeric columns of a text file as an (nrows, ncols) float64 array.
+
+    The number of columns is taken from the first data line; with ncols
+    only the first ncols of them are returned. Lines before the first
+    numeric line are treated as header and skipped.
+    """
+    with open(file_name, 'rb') as f:
+        try:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # empty file
+            return np.empty((0, ncols or 0))
+        try:
+            start = _data_start(buf)
+            end = buf.find(b'\n', start)
+            first = buf[start:len(buf) if end < 0 else end]
+            skiprows = buf[:start].count(b'\n')
+            if first.strip() and b',' not in first and b';' not in first:
+                try:
+                    return np.loadtxt(file_name, skiprows=skiprows, comments=None,
+                                      ndmin=2)[:, :ncols]
+                except ValueError:  # stray text or ragged rows
+                    pass
+            return _parse(buf, start, ncols, chunk_bytes)
+        finally:
+            buf.close()
+
+
+def _parse(buf, start, ncols, chunk_bytes):
+    end = buf.find(b'\n', start)
+    first = buf[start:len(buf) if end < 0 else end]
+    # a decimal comma shows up as commas without any dots
+    comma = b',' in first and b'.' not in first
+    filecols = len(first.replace(b',', b'.' if comma else b' ').replace(b';', b' ').split())
+    if ncols is None:
+        ncols = filecols
+    if filecols == 0:
+        return np.empty((0, ncols))
+
+    nrows = 1+sum(buf[p:p+chunk_bytes].count(b'\n') for p in range(start, len(buf), chunk_bytes))
+    out = np.empty(nrows*filecols)
+    n = 0
+    pos = start
+    while pos < len(buf):
+        stop = buf.rfind(b'\n', pos, pos+chunk_bytes)+1 if pos+chunk_bytes < len(buf) else len(buf)
+        if stop <= pos:  # a single line longer than a chunk
+            stop = buf.find(b'\n', pos+chunk_bytes)+1 or len(buf)
+        chunk = buf[pos:stop]
+        pos = stop
+        if comma:
+            chunk = chunk.replace(b',', b'.')
+        elif b',' in chunk or b';' in chunk:
+            chunk = chunk.replace(b',', b' ').replace(b';', b' ')
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', DeprecationWarning)
+            try:
+                values = np.fromstring(chunk, sep=' ')
+            except (DeprecationWarning, ValueError):
+                values = None
+        if values is None or len(values) % filecols:
+            rows = [r for r in _tolerant(chunk, False) if len(r) == filecols]
+            values = np.array(rows, dtype=float).ravel()
+        out[n:n+len(values)] = values
+        n += len(values)
+    # like Read_Two_Column_File, extra columns are ignored
+    return out[:n].reshape(-1, filecols)[:, :ncols]
+
+
+def read_two_column_file(file_name):
+    """Drop-in for Read_Two_Column_File, returning arrays instead of lists."""
+    data = read_columns(file_name, 2)
+    return data[:, 0], data[:, 1]
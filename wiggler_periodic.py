@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+Periodic-cell solve mode.
+
+Rather than meshing all numrepeats+3 periods plus the boundhoriz air margins,
+only one regular cell (B2/WDRIFT/B3/WDRIFT/B4/WDRIFT/B5/WDRIFT, og_thickness
+long) is built and its side edges are tied together with the Periodic /
+Antiperiodic boundary conditions the scripts already create. Because the
+second half of a cell is the first half with every magdir reversed, the
+antiperiodic mode only needs half a cell. The interior field of the long
+device is then recovered by tiling the cell solution.
+"""
+
+import numpy as np
+
+from wiggler_blocks import cell_table
+from wiggler_femfile import FemModel, add_gap_band, solve
+from wiggler_readout import FemmReadout, profile
+
+
+def build_cell_model(p, antiperiodic=True):
+    """FemModel of a single cell with periodic side boundaries.
+
+    With antiperiodic=True the model is half a cell (og_thickness/2) long
+    with antiperiodic sides, otherwise a full cell with periodic sides.
+    """
+    magnetSep, magnetWidth, steelThick = p['magnetSep'], p['magnetWidth'], p['steelThick']
+    if antiperiodic:
+        h, ncell, kind, fmt = p['og_thickness']/2, 2, 'Antiperiodic', 5
+    else:
+        h, ncell, kind, fmt = p['og_thickness'], 4, 'Periodic', 4
+
+    model = FemModel()
+    model.probdef(0, p['units'], 'planar', 1E-8, magnetWidth)
+    model.getmaterial(p['magnetType'])
+    model.getmaterial(p['steelType'])
+    model.getmaterial('Air')
+
+    model.addblocks(cell_table(p, ncell), p['magnetMesh'])
+    if steelThick > 0:
+        inner = magnetSep+magnetWidth
+        model.drawrectangle(0, inner, h, inner+steelThick)
+        model.drawrectangle(0, -inner, h, -inner-steelThick)
+        model.addblocklabel(h/2, inner+0.5*steelThick, p['steelType'], 0, p['steelMesh'], 0, 1, 0)
+        model.addblocklabel(h/2, -inner-0.5*steelThick, p['steelType'], 0, p['steelMesh'], 0, 1, 0)
+    if p['gapBand'] > 0:
+        # the periodic edges drawn below close the band, which splits the gap
+        # into the band and the air above and below it
+        add_gap_band(model, p, 0, h, sides=False)
+        gap = (p['gapBand']+magnetSep)/2
+        model.addblocklabel(h/2, gap, "Air", 0, p['airMesh'], 0, 1, 0)
+        model.addblocklabel(h/2, -gap, "Air", 0, p['airMesh'], 0, 1, 0)
+    else:
+        model.addblocklabel(h/2, 0, "Air", 0, p['airMesh'], 0, 1, 0)
+    model.drawline(0, 4*magnetWidth, h, 4*magnetWidth)
+    model.drawline(0, -4*magnetWidth, h, -4*magnetWidth)
+    if steelThick > 0 or p['interMagnet'] == 0:
+        # the steel (or a closed magnet row) runs from edge to edge and cuts
+        # off the air above and below it
+        outer = (magnetSep+magnetWidth+steelThick+4*magnetWidth)/2
+        model.addblocklabel(h/2, outer, "Air", 0, p['airMesh'], 0, 1, 0)
+        model.addblocklabel(h/2, -outer, "Air", 0, p['airMesh'], 0, 1, 0)
+    model.addnode(0, 0)
+    model.addnode(h, 0)
+
+    # FEMM needs the left and right edges split at the same heights, with
+    # its own periodic boundary property for every pair of segments
+    ends = np.array([s[:4] for s in model.segments]).reshape(-1, 2)
+    ends = np.concatenate([ends, np.array([n[:2] for n in model.nodes])])
+    onedge = np.isclose(ends[:, 0], 0) | np.isclose(ends[:, 0], h)
+    levels = np.unique(np.round(ends[onedge, 1], 9))
+    for i, (y1, y2) in enumerate(zip(levels[:-1], levels[1:])):
+        name = '%s%d' % (kind, i)
+        model.addboundprop(name, 0, 0, 0, 0, 0, 0, 0, 0, fmt)
+        model.drawline(0, y1, 0, y2, name)
+        model.drawline(h, y1, h, y2, name)
+    return model
+
+
+def solve_cell(p, filename, femm=None, antiperiodic=True, numpoints=500):
+    """Solve the cell model and sample By on axis across it.
+
+    Returns (s, by) with s measured from the start of the cell.
+    """
+    if femm is None:
+        import femm
+    solve(build_cell_model(p, antiperiodic), filename, femm)
+    h = p['og_thickness']/2 if antiperiodic else p['og_thickness']
+    with FemmReadout(femm) as readout:
+        s, bx, by, bmag = profile(readout, 0, 0, h, 0, numpoints)
+    return s, by
+
+
+def tile_cell_field(s_cell, b_cell, s, antiperiodic=True, s0=0):
+    """Field of the cell solution repeated along s.
+
+    s_cell/b_cell sample one model cell starting at 0, s0 is where the first
+    cell starts in s. With antiperiodic=True every other copy is reversed.
+    """
+    s_cell = np.asarray(s_cell, dtype=float)
+    h = s_cell[-1]-s_cell[0]
+    u = np.asarray(s, dtype=float)-s0
+    k = np.floor(u/h)
+    b = np.interp(u-k*h+s_cell[0], s_cell, np.asarray(b_cell, dtype=float))
+    if antiperiodic:
+        b = np.where(k % 2 == 0, b, -b)
+    return b
+
+
+if __name__ == '__main__':
+    import femm
+    from wiggler_design import onaxis_design
+    from wiggler_headless import pyplot, show
+
+    p = onaxis_design()
+    femm.openfemm()
+    s_cell, by_cell = solve_cell(p, 'wiggle_cell.FEM', femm)
+    s = np.linspace(p['og_thickness'], p['og_thickness']*(p['numrepeats']+2), 25000)
+    plt = pyplot()
+    plt.plot(s, tile_cell_field(s_cell, by_cell, s, s0=p['og_thickness']))
+    show('wiggler_periodic')
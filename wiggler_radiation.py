@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""
+Synchrotron radiation integrals and damping of a ring with the wiggler.
+
+"The modified damping times with the wiggler are sufficient to reach the
+desired beam emittance during the time the beam is in the damping ring."
+
+The wiggler contributions to I2..I5 are computed from the sampled By(s) with
+the curvature h = By/Brho and the dispersion the wiggler itself generates,
+D'' = h (plus whatever D, D' the lattice has at the entrance). Added to the
+integrals of the bare ring they give the energy loss per turn, partition
+numbers, damping times, equilibrium emittance and energy spread (electrons
+or positrons, isomagnetic formulas of e.g. Wille ch. 6).
+
+Every function broadcasts over leading axes, so by (and s) of shape
+(ncases, ns) evaluate a whole sweep in one call.
+"""
+
+import numpy as np
+
+from wiggler_design import UNIT_LENGTH
+from wiggler_trajectory import ELECTRON_MASS, field_integrals, rigidity
+
+C_GAMMA = 8.846e-5  # m/GeV^3
+C_Q = 3.832e-13  # m
+C = 299792458.0  # m/s
+
+
+def ring_design(**overrides):
+    """Ring parameters, wiggler optics and bare-ring radiation integrals.
+
+    The defaults are an example ring at the pDR energy with isomagnetic arcs
+    of 5 m bending radius. Replace synch_2..synch_5 with SYNCH_2..SYNCH_5
+    from the MAD-X TWISS summary of the real lattice (without wigglers).
+    betax/alphax/etax/etapx are the optics at the wiggler entrance, betay,
+    alphay and the vertical tune qy those wiggler_focusing needs.
+    """
+    r = dict(energy=1.54,  # GeV
+             circumference=241.8,  # m
+             nwigglers=4,
+             rho=5.0,  # m, arc bending radius for the isomagnetic defaults
+             mean_H=2e-3,  # m, mean curly-H in the arc dipoles
+             betax=10.0, alphax=0.0, etax=0.0, etapx=0.0,
+             betay=10.0, alphay=0.0, qy=4.2,
+             injected_emittance=1e-6,  # m.rad
+             store_time=0.05)  # s
+    r.update(overrides)
+    r.setdefault('synch_2', 2*np.pi/r['rho'])
+    r.setdefault('synch_3', 2*np.pi/r['rho']**2)
+    r.setdefault('synch_4', 0.0)
+    r.setdefault('synch_5', 2*np.pi*r['mean_H']/r['rho']**2)
+    return r
+
+
+def _integral(y, s):
+    return np.sum(0.5*(y[..., 1:]+y[..., :-1])*np.diff(s, axis=-1), axis=-1)
+
+
+def wiggler_integrals(s, by, energy, units='millimeters', betax=10.0, alphax=0.0,
+                      etax=0.0, etapx=0.0):
+    """Radiation integrals I2, I3, I4, I5 of one pass through the wiggler.
+
+    s is in the problem length unit and by in T, both with samples along the
+    last axis. Returns a dict of arrays of shape by.shape[:-1], in m^-1,
+    m^-2, m^-1 and m^-1.
+    """
+    s = np.asarray(s, dtype=float)
+    by = np.asarray(by, dtype=float)
+    i1, i2 = field_integrals(s, by, units)
+    sm = s*UNIT_LENGTH[units]
+    sm = sm-sm[..., :1]
+    brho = rigidity(energy)
+    h = by/brho
+    eta = etax+etapx*sm+i2/brho
+    etap = etapx+i1/brho
+    gammax = (1+alphax**2)/betax
+    beta = betax-2*alphax*sm+gammax*sm**2
+    alpha = alphax-gammax*sm
+    H = gammax*eta**2+2*alpha*eta*etap+beta*etap**2
+    h2 = h*h
+    h3 = np.abs(h)*h2
+    sm = np.broadcast_to(sm, by.shape)
+    return dict(I2=_integral(h2, sm), I3=_integral(h3, sm),
+                I4=_integral(eta*h*h2, sm), I5=_integral(H*h3, sm))
+
+
+def ring_with_wiggler(ring, integrals):
+    """Equilibrium beam of the ring with nwigglers wigglers of the given integrals.
+
+    Returns a dict (broadcast over the integrals' shape) of the total
+    integrals, U0 [GeV], the partition numbers Jx, Jy, Je, the damping times
+    taux, tauy, taue [s], the emittance [m.rad], the relative energy spread
+    and the emittance reached after store_time from injected_emittance.
+    """
+    n = ring['nwigglers']
+    energy = ring['energy']
+    I2 = ring['synch_2']+n*integrals['I2']
+    I3 = ring['synch_3']+n*integrals['I3']
+    I4 = ring['synch_4']+n*integrals['I4']
+    I5 = ring['synch_5']+n*integrals['I5']
+    gamma = energy/ELECTRON_MASS
+    U0 = C_GAMMA/(2*np.pi)*energy**4*I2
+    Jx, Jy, Je = 1-I4/I2, np.ones_like(I2), 2+I4/I2
+    T0 = ring['circumference']/C
+    tau = 2*energy*T0/U0
+    emittance = C_Q*gamma**2*I5/(Jx*I2)
+    stored = emittance+(ring['injected_emittance']-emittance)*np.exp(-2*ring['store_time']*Jx/tau)
+    return dict(I2=I2, I3=I3, I4=I4, I5=I5, U0=U0, Jx=Jx, Jy=Jy, Je=Je,
+                taux=tau/Jx, tauy=tau/Jy, taue=tau/Je, emittance=emittance,
+                energy_spread=np.sqrt(C_Q*gamma**2*I3/(Je*I2)),
+                extracted_emittance=stored)
+
+
+def radiation(s, by, ring=None, units='millimeters'):
+    """Damping-ring figures of merit for one or many (stacked) By(s) profiles."""
+    ring = ring_design() if ring is None else ring
+    integrals = wiggler_integrals(s, by, ring['energy'], units, ring['betax'],
+                                  ring['alphax'], ring['etax'], ring['etapx'])
+    return ring_with_wiggler(ring, integrals)
+
+
+if __name__ == '__main__':
+    from wiggler_analytic import onaxis_profile
+    from wiggler_design import onaxis_design
+
+    ring = ring_design()
+    bare = ring_with_wiggler(ring, dict(I2=0, I3=0, I4=0, I5=0))
+    p = onaxis_design()
+    s, bx, by = onaxis_profile(p, 25000)
+    with_wiggler = radiation(s, by, ring, p['units'])
+    for name, unit, scale in [('U0', 'keV', 1e6), ('taux', 'ms', 1e3), ('taue', 'ms', 1e3),
+                              ('emittance', 'nm', 1e9), ('energy_spread', '1e-3', 1e3),
+                              ('extracted_emittance', 'nm', 1e9)]:
+        print('%20s %12.4g %12.4g %s' % (name, bare[name]*scale, with_wiggler[name]*scale, unit))
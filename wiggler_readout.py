@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+"""
+Batched field readout.
+
+mo_makeplot(1, ...) only writes |B| to a fixed text file, so the sign of By
+is lost and parallel runs overwrite each other's temp_B.txt. Here a whole
+array of points is evaluated with one Lua loop inside FEMM (a single
+round-trip) that calls mo_getb for every point, and the signed Bx, By and
+|B| come back as NumPy arrays. Points and results pass through a scratch
+directory private to the readout object, since pyfemm can only hand back
+the value of a single Lua expression.
+
+Any object with a getb(x, y) method returning (bx, by, bmag) can stand in
+for FemmReadout, e.g. FunctionReadout around the analytic engine or
+GridReadout over a cached field map, so code using a readout runs without
+FEMM.
+"""
+
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from wiggler_parse import read_columns
+
+_LUA = '''local fin = openfile("%(points)s", "r")
+local fout = openfile("%(out)s", "w")
+local n = read(fin, "*n")
+for i = 1, n do
+  local x = read(fin, "*n")
+  local y = read(fin, "*n")
+  local bx, by = mo_getb(x, y)
+  write(fout, format("%%.17g %%.17g\\n", bx, by))
+end
+closefile(fin)
+closefile(fout)
+'''
+
+
+def _luapath(path):
+    return os.path.abspath(path).replace('\\', '/')
+
+
+class FemmReadout:
+    """Signed flux density from the solution currently loaded in FEMM."""
+
+    def __init__(self, femm=None, scratch=None):
+        if femm is None:
+            import femm
+        self.femm = femm
+        self.owns_scratch = scratch is None
+        self.scratch = tempfile.mkdtemp(prefix='wiggler_') if scratch is None else scratch
+        os.makedirs(self.scratch, exist_ok=True)
+
+    def lua_script(self, points, out):
+        return _LUA % dict(points=_luapath(points), out=_luapath(out))
+
+    def run(self, x, y):
+        """Evaluate the 1D point arrays x, y in FEMM; returns the result file name."""
+        points = os.path.join(self.scratch, 'points.txt')
+        out = os.path.join(self.scratch, 'getb.txt')
+        script = os.path.join(self.scratch, 'getb.lua')
+        with open(points, 'w') as f:
+            f.write('%d\n' % len(x))
+            np.savetxt(f, np.column_stack([x, y]), fmt='%.17g')
+        with open(script, 'w') as f:
+            f.write(self.lua_script(points, out))
+        call = getattr(self.femm, 'callfemm_noeval', None) or self.femm.callfemm
+        call('dofile("%s")' % _luapath(script))
+        return out
+
+    def getb(self, x, y):
+        """(bx, by, bmag) at the points (x, y), which broadcast together."""
+        x, y = np.broadcast_arrays(np.asarray(x, dtype=float), np.asarray(y, dtype=float))
+        b = read_columns(self.run(x.ravel(), y.ravel()), 2)
+        bx = b[:, 0].reshape(x.shape)
+        by = b[:, 1].reshape(x.shape)
+        return bx, by, np.hypot(bx, by)
+
+    def close(self):
+        if self.owns_scratch:
+            shutil.rmtree(self.scratch, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class FunctionReadout:
+    """Readout backed by a function f(x, y) -> (bx, by), e.g. the analytic engine."""
+
+    def __init__(self, function):
+        self.function = function
+
+    def getb(self, x, y):
+        bx, by = self.function(np.asarray(x, dtype=float), np.asarray(y, dtype=float))
+        return bx, by, np.hypot(bx, by)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class GridReadout:
+    """Readout interpolating a cached (ny, nx) field map bilinearly.
+
+    x and y are the increasing 1D grid coordinates of the map, as returned
+    by wiggler_fieldmap.field_map. Points outside the grid are NaN.
+    """
+
+    def __init__(self, x, y, bx, by):
+        self.x = np.asarray(x, dtype=float)
+        self.y = np.asarray(y, dtype=float)
+        self.bx = np.asarray(bx, dtype=float)
+        self.by = np.asarray(by, dtype=float)
+
+    def _interp(self, table, i, j, u, v):
+        return ((1-v)*((1-u)*table[j, i]+u*table[j, i+1])
+                + v*((1-u)*table[j+1, i]+u*table[j+1, i+1]))
+
+    def getb(self, x, y):
+        x, y = np.broadcast_arrays(np.asarray(x, dtype=float), np.asarray(y, dtype=float))
+        i = np.clip(np.searchsorted(self.x, x, 'right')-1, 0, len(self.x)-2)
+        j = np.clip(np.searchsorted(self.y, y, 'right')-1, 0, len(self.y)-2)
+        u = (x-self.x[i])/(self.x[i+1]-self.x[i])
+        v = (y-self.y[j])/(self.y[j+1]-self.y[j])
+        outside = (u < 0) | (u > 1) | (v < 0) | (v > 1)
+        bx = np.where(outside, np.nan, self._interp(self.bx, i, j, u, v))
+        by = np.where(outside, np.nan, self._interp(self.by, i, j, u, v))
+        return bx, by, np.hypot(bx, by)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class MirroredReadout:
+    """Full-plane readout of a model built for one side of its symmetry planes.
+
+    With midplane=True (p['halfModel']) points below y=0 are read at their
+    mirror image; By is even and Bx odd in y. With a centre s (p['halfLength'])
+    points beyond it are read at their mirror image; By is odd and Bx even
+    about the centre.
+    """
+
+    def __init__(self, readout, midplane=True, centre=None):
+        self.readout = readout
+        self.midplane = midplane
+        self.centre = centre
+
+    def getb(self, x, y):
+        x, y = np.broadcast_arrays(np.asarray(x, dtype=float), np.asarray(y, dtype=float))
+        xsign = ysign = 1
+        if self.midplane:
+            ysign = np.where(y < 0, -1, 1)
+            y = np.abs(y)
+        if self.centre is not None:
+            xsign = np.where(x > self.centre, -1, 1)
+            x = np.where(x > self.centre, 2*self.centre-x, x)
+        bx, by, bmag = self.readout.getb(x, y)
+        return ysign*bx, xsign*by, bmag
+
+    def close(self):
+        self.readout.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def symmetric_readout(readout, p):
+    """readout, wrapped in a MirroredReadout if p is a half or half-length model."""
+    if not (p['halfModel'] or p['halfLength']):
+        return readout
+    from wiggler_blocks import device_centre
+
+    centre = device_centre(p) if p['halfLength'] else None
+    return MirroredReadout(readout, p['halfModel'], centre)
+
+
+def profile(readout, x0, y0, x1, y1, numpoints):
+    """Field along the line (x0,y0)-(x1,y1), like mo_addcontour + mo_makeplot.
+
+    Returns (s, bx, by, bmag) with s the distance from (x0, y0).
+    """
+    t = np.linspace(0, 1, numpoints)
+    bx, by, bmag = readout.getb(x0+t*(x1-x0), y0+t*(y1-y0))
+    return t*np.hypot(x1-x0, y1-y0), bx, by, bmag
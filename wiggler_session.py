@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+"""
+Incremental model updates in a running FEMM document.
+
+wiggler_4_changing_materials.py compares magnet and steel grades by
+re-running the whole script: new document, every node, every segment,
+mi_copytranslate2. A ModelSession builds and opens the geometry once, with
+the block labels grouped by role (one group per magnetisation direction,
+row and half of the device, one for the steel, one for the air, one for the gap band if any).
+A change of material, magdir or mesh size is then applied with mi_selectgroup + mi_setblockprop on the labels
+already in the document, and only mi_analyze runs again.
+
+    python wiggler_session.py   (benchmark against full rebuilds)
+"""
+
+import os
+import time
+
+from wiggler_blocks import device_centre
+from wiggler_design import MATERIALS
+from wiggler_femfile import build_onaxis_model
+
+# label groups; every magnet by the magdir m (mod 360) of its partner in the
+# top row of the entrance half: the bottom row is the up/down mirror with
+# 180-m, the exit half (past device_centre) the end-to-end mirror with -m
+MAGNET_GROUPS = {0: 10, 90: 11, 180: 12, 270: 13}
+BOTTOM_GROUPS = {0: 14, 90: 15, 180: 16, 270: 17}
+EXIT_GROUPS = {0: 50, 90: 51, 180: 52, 270: 53}
+EXIT_BOTTOM_GROUPS = {0: 54, 90: 55, 180: 56, 270: 57}
+# (groups, sign, offset): a magnet of groups[m] has magdir offset+sign*m
+MIRRORS = ((MAGNET_GROUPS, 1, 0), (BOTTOM_GROUPS, -1, 180),
+           (EXIT_GROUPS, -1, 0), (EXIT_BOTTOM_GROUPS, 1, 180))
+STEEL_GROUP = 20
+AIR_GROUP = 30
+GAP_GROUP = 40
+
+
+def grouped_model(p):
+    """build_onaxis_model(p) with the block labels in the session groups."""
+    model = build_onaxis_model(p)
+    # the centre magnets (magdir 0 or 180, their own end-to-end partners)
+    # count as entrance half
+    centre = device_centre(p)+1e-6*p['magnetLength']
+    labels = []
+    for x, y, material, automesh, meshsize, magdir, group, turns in model.labels:
+        if material == p['magnetType']:
+            groups, sign, offset = MIRRORS[2*(x > centre)+(y < 0)]
+            group = groups[int(round(sign*(magdir-offset))) % 360]
+        elif material == p['steelType']:
+            group = STEEL_GROUP
+        elif group == 2:  # add_gap_band
+            group = GAP_GROUP
+        else:
+            group = AIR_GROUP
+        labels.append((x, y, material, automesh, meshsize, magdir, group, turns))
+    model.labels = labels
+    return model
+
+
+class ModelSession:
+    """One open FEMM document of the design p whose block properties can change.
+
+    FEMM must already be running. The geometry is written to filename and
+    opened once; solve() meshes and solves the current state and leaves the
+    solution loaded for readout.
+    """
+
+    def __init__(self, p, filename='wiggle_session.FEM', femm=None):
+        if femm is None:
+            import femm
+        self.femm = femm
+        self.p = dict(p)
+        self.filename = os.path.abspath(filename)
+        model = grouped_model(p)
+        self.materials = set(model.materials)
+        # current block properties per group: [material, meshsize, magdir]
+        self.props = {group: [p['magnetType'], p['magnetMesh'], offset+sign*magdir]
+                      for groups, sign, offset in MIRRORS for magdir, group in groups.items()}
+        self.props[STEEL_GROUP] = [p['steelType'], p['steelMesh'], 0]
+        self.props[AIR_GROUP] = ['Air', p['airMesh'], 0]
+        self.props[GAP_GROUP] = ['Air', p['gapMesh'], 0]
+        model.write(self.filename)
+        femm.opendocument(self.filename)
+
+    def _addmaterial(self, name):
+        # same data as the .FEM file written by FemModel
+        if name in self.materials:
+            return
+        if name not in MATERIALS:
+            raise KeyError('no material data for %r, add it to wiggler_design.MATERIALS' % name)
+        m = MATERIALS[name]
+        self.femm.mi_addmaterial(name, m['Mu_x'], m['Mu_y'], m['H_c'], 0, m['Sigma'],
+                                 0, 0, 1, 0, 0, 0, 0, 0)
+        for B, H in m['BH']:
+            self.femm.mi_addbhpoint(name, B, H)
+        self.materials.add(name)
+
+    def _apply(self, groups):
+        femm = self.femm
+        for group in groups:
+            material, meshsize, magdir = self.props[group]
+            self._addmaterial(material)
+            femm.mi_clearselected()
+            femm.mi_selectgroup(group)
+            femm.mi_setblockprop(material, 1 if meshsize <= 0 else 0, meshsize, '',
+                                 magdir, group, 0)
+        femm.mi_clearselected()
+
+    def set_magnets(self, magnetType=None, mess_size=None):
+        """Change the magnet material and/or mesh size of all magnets."""
+        groups = [group for groups, sign, offset in MIRRORS for group in groups.values()]
+        for group in groups:
+            if magnetType is not None:
+                self.props[group][0] = magnetType
+            if mess_size is not None:
+                self.props[group][1] = mess_size
+        if magnetType is not None:
+            self.p['magnetType'] = magnetType
+        self._apply(groups)
+
+    def set_magdirs(self, magdirs):
+        """Set absolute magdirs per group, keeping the device symmetries.
+
+        Keys are the original magdir (0, 90, 180, 270) in the top row of the
+        entrance half, values the new one there; the bottom-row partners get
+        180-new and the end-to-end partners in the exit half -new and 180+new.
+        E.g. {90: 95} sets the entrance top-row 90 degree magnets to 95, their
+        bottom-row partners to 85, the exit top-row -90 degree magnets to -95
+        and their bottom-row partners to 275. A halfLength model has no exit
+        half, so the same call describes the same device there.
+        """
+        groups = []
+        for magdir, new in magdirs.items():
+            key = int(magdir) % 360
+            for mirror, sign, offset in MIRRORS:
+                self.props[mirror[key]][2] = offset+sign*new
+                groups.append(mirror[key])
+        self._apply(groups)
+
+    def set_steel(self, steelType=None, mess_size=None):
+        if steelType is not None:
+            self.props[STEEL_GROUP][0] = self.p['steelType'] = steelType
+        if mess_size is not None:
+            self.props[STEEL_GROUP][1] = mess_size
+        self._apply([STEEL_GROUP])
+
+    def set_air(self, mess_size=None, gap_mess_size=None):
+        """Change the mesh size of the far air and/or of the gap band."""
+        groups = []
+        if mess_size is not None:
+            self.props[AIR_GROUP][1] = mess_size
+            groups.append(AIR_GROUP)
+        if gap_mess_size is not None and self.p['gapBand'] > 0:
+            self.props[GAP_GROUP][1] = gap_mess_size
+            groups.append(GAP_GROUP)
+        self._apply(groups)
+
+    def solve(self):
+        self.femm.mi_analyze(0)
+        self.femm.mi_loadsolution()
+
+
+def benchmark(p, magnetTypes=('N52', 'SmCo32'), filename='wiggle_session.FEM', femm=None):
+    """Seconds per variant for a full rebuild and for a session update.
+
+    Returns dicts {'build', 'solve'} of mean times; the rebuild includes
+    compiling, writing and opening the .FEM file, the session update only
+    the mi_setblockprop calls.
+    """
+    from wiggler_design import onaxis_design
+
+    if femm is None:
+        import femm
+    rebuild = dict(build=0.0, solve=0.0)
+    for magnetType in magnetTypes:
+        t = time.perf_counter()
+        model = build_onaxis_model(onaxis_design(**dict(p, magnetType=magnetType)))
+        model.write(filename)
+        femm.opendocument(os.path.abspath(filename))
+        rebuild['build'] += time.perf_counter()-t
+        t = time.perf_counter()
+        femm.mi_analyze(0)
+        femm.mi_loadsolution()
+        rebuild['solve'] += time.perf_counter()-t
+
+    update = dict(build=0.0, solve=0.0)
+    t = time.perf_counter()
+    session = ModelSession(p, filename, femm)
+    setup = time.perf_counter()-t
+    for magnetType in magnetTypes:
+        t = time.perf_counter()
+        session.set_magnets(magnetType)
+        update['build'] += time.perf_counter()-t
+        t = time.perf_counter()
+        session.solve()
+        update['solve'] += time.perf_counter()-t
+    n = len(magnetTypes)
+    rebuild = {k: v/n for k, v in rebuild.items()}
+    update = {k: v/n for k, v in update.items()}
+    update['setup'] = setup
+    return rebuild, update
+
+
+if __name__ == '__main__':
+    import femm
+    from wiggler_design import onaxis_design
+
+    femm.openfemm()
+    rebuild, update = benchmark(onaxis_design())
+    print('full rebuild:   %.3f s build, %.3f s solve per variant' % (rebuild['build'], rebuild['solve']))
+    print('session update: %.3f s build, %.3f s solve per variant (%.3f s once)'
+          % (update['build'], update['solve'], update['setup']))
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+Stand-in for the pyfemm calls this repo makes, backed by the analytic engine.
+
+It lets the whole FEMM pipeline (write .FEM, open, mesh, analyze, batched
+readout and parse) run where FEMM is not installed, e.g. in CI. The field
+comes from wiggler_analytic for the design given at construction, so it is
+iron free. Meshing and solving are not modelled: they cost nothing and
+mo_numelements() is 0. Readout goes through the same Lua script files as
+real FEMM: the points file named in the script is read and the result file
+is written in the format the script would produce.
+"""
+
+import re
+
+import numpy as np
+
+from wiggler_analytic import field
+from wiggler_blocks import variant_table
+
+_OPENFILE = re.compile(r'openfile\("([^"]*)",\s*"([rw])"\)')
+_DOFILE = re.compile(r'dofile\("([^"]*)"\)')
+
+
+def readout_files(expression):
+    """(points file, result file) of a dofile("getb.lua") readout request."""
+    match = _DOFILE.search(expression)
+    if not match:
+        raise ValueError('stand-in only runs dofile(), got %r' % expression)
+    with open(match.group(1)) as f:
+        files = dict((mode, name) for name, mode in _OPENFILE.findall(f.read()))
+    return files['r'], files['w']
+
+
+def read_points(filename):
+    """(n, 2) array of the points file a readout script reads."""
+    with open(filename) as f:
+        n = int(f.readline())
+        return np.loadtxt(f, ndmin=2).reshape(n, 2)
+
+
+class StandinFemm:
+    """Object with the femm module functions used here, for the design p."""
+
+    def __init__(self, p, cutoff=None):
+        self.cutoff = cutoff
+        self.document = None
+        self.set_design(p)
+
+    def set_design(self, p):
+        """Answer readouts with the field of the design p from now on."""
+        self.p = p
+        self.blocks = variant_table(p)
+
+    def openfemm(self, hide=0):
+        pass
+
+    def closefemm(self):
+        pass
+
+    def opendocument(self, filename):
+        with open(filename) as f:
+            f.read()  # as FEMM would, so the cost of reading it is included
+        self.document = filename
+
+    def mi_createmesh(self):
+        return 0
+
+    def mi_analyze(self, flag=0):
+        if self.document is None:
+            raise RuntimeError('no document open')
+
+    def mi_loadsolution(self):
+        pass
+
+    def mo_numelements(self):
+        return 0
+
+    def callfemm_noeval(self, expression):
+        points, out = readout_files(expression)
+        xy = read_points(points)
+        bx, by = field(xy[:, 0], xy[:, 1], self.blocks, cutoff=self.cutoff)
+        np.savetxt(out, np.column_stack([bx, by]), fmt='%.17g')
+
+    callfemm = callfemm_noeval
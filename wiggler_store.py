@@ -0,0 +1,305 @@
+# -*- coding: utf-8 -*-
+"""
+Chunked field-map store on disk.
+
+A solved field otherwise only lives in temp_B.txt or in memory. A store is
+a directory holding a 2D field map over s and y (signed Bx, By), the
+sample coordinates, the full design parameters and where the map came
+from:
+
+    meta.json         format, shape, chunking, dtype, design, provenance
+    s.npy, y.npy      sample coordinates (ns,), (ny,)
+    bx_00000.npy ...  (ny, chunk) column blocks of Bx and By along s, or
+    by_00000.npy      chunk_00000.npz with both when compressed
+
+Plain .npy chunks are opened memory-mapped, so slicing an s-range or one
+period reads only the pages of the chunks it touches; compressed chunks
+are decompressed one chunk at a time. Nothing loads the whole map unless
+asked for the whole range. The map is written chunk by chunk as well
+(store_field_map), so it never has to fit in memory either.
+
+StoreReadout makes a store a readout (getb) for wiggler_multipoles and
+the other readout users, and FieldMapStore.line gives the (s, by) profile
+that wiggler_trajectory, wiggler_radiation and wiggler_madx take, all
+without solving again.
+
+    python wiggler_store.py build wiggler_map   (analytic map of the default design)
+    python wiggler_store.py report wiggler_map  (closure, poles, MAD-X from the store)
+"""
+
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from wiggler_readout import GridReadout
+
+FORMAT = 'wiggler-fieldmap'
+VERSION = 1
+
+
+def provenance(**extra):
+    """Who, when and what produced a map: time, host, versions, git commit."""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ''
+    info = dict(created=time.strftime('%Y-%m-%dT%H:%M:%S'), host=platform.node(),
+                python=platform.python_version(), numpy=np.__version__, commit=commit or None,
+                argv=sys.argv)
+    info.update(extra)
+    return info
+
+
+class FieldMapWriter:
+    """Writes a store column block by column block.
+
+    Call write(bx, by) with (ny, n) blocks in s order until all ns columns
+    are written, then close() (or use as a context manager).
+    """
+
+    def __init__(self, path, s, y, design=None, chunk=4096, compress=False, dtype='f8',
+                 **provenance_info):
+        self.path = path
+        self.s = np.asarray(s, dtype=float)
+        self.y = np.asarray(y, dtype=float)
+        self.chunk, self.compress, self.dtype = int(chunk), bool(compress), np.dtype(dtype)
+        self.design = dict(design or {})
+        self.provenance = provenance(**provenance_info)
+        self.written = 0
+        self._bx, self._by = [], []
+        self._pending = 0
+        self.nchunks = 0
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, 's.npy'), self.s)
+        np.save(os.path.join(path, 'y.npy'), self.y)
+
+    def _flush(self, final=False):
+        while self._pending >= self.chunk or (final and self._pending):
+            bx, by = np.concatenate(self._bx, axis=1), np.concatenate(self._by, axis=1)
+            n = min(self.chunk, bx.shape[1])
+            block = dict(bx=np.ascontiguousarray(bx[:, :n], self.dtype),
+                         by=np.ascontiguousarray(by[:, :n], self.dtype))
+            if self.compress:
+                np.savez_compressed(os.path.join(self.path, 'chunk_%05d.npz' % self.nchunks),
+                                    **block)
+            else:
+                for name, values in block.items():
+                    np.save(os.path.join(self.path, '%s_%05d.npy' % (name, self.nchunks)), values)
+            self.nchunks += 1
+            self._bx, self._by = [bx[:, n:]], [by[:, n:]]
+            self._pending -= n
+
+    def write(self, bx, by):
+        bx, by = np.atleast_2d(bx), np.atleast_2d(by)
+        if bx.shape != by.shape or bx.shape[0] != len(self.y):
+            raise ValueError('blocks must be (ny, n) = (%d, n), got %s and %s'
+                             % (len(self.y), bx.shape, by.shape))
+        if self.written+bx.shape[1] > len(self.s):
+            raise ValueError('more columns than the %d samples in s' % len(self.s))
+        self._bx.append(bx)
+        self._by.append(by)
+        self._pending += bx.shape[1]
+        self.written += bx.shape[1]
+        self._flush()
+
+    def close(self):
+        self._flush(final=True)
+        if self.written != len(self.s):
+            raise ValueError('%d of %d columns written' % (self.written, len(self.s)))
+        meta = dict(format=FORMAT, version=VERSION, shape=[len(self.y), len(self.s)],
+                    chunk=self.chunk, nchunks=self.nchunks, compress=self.compress,
+                    dtype=self.dtype.str, design=self.design, provenance=self.provenance)
+        with open(os.path.join(self.path, 'meta.json'), 'w') as f:
+            json.dump(meta, f, indent=1, default=_jsonable)
+        return FieldMapStore(self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+
+
+def _jsonable(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    return str(value)
+
+
+def write_field_map(path, s, y, bx, by, design=None, chunk=4096, compress=False, dtype='f8',
+                    **provenance_info):
+    """Store (ny, ns) maps bx, by already in memory; returns the FieldMapStore."""
+    with FieldMapWriter(path, s, y, design, chunk, compress, dtype, **provenance_info) as w:
+        w.write(bx, by)
+    return FieldMapStore(path)
+
+
+def store_field_map(path, readout, s, y, design=None, mask=None, chunk=4096, compress=False,
+                    dtype='f8', **provenance_info):
+    """Evaluate a readout on the grid s x y straight into a store, chunk by chunk.
+
+    readout and mask as for wiggler_fieldmap.field_map; only one chunk of
+    columns is held in memory at a time. Returns the FieldMapStore.
+    """
+    from wiggler_fieldmap import field_map
+
+    s = np.asarray(s, dtype=float)
+    with FieldMapWriter(path, s, y, design, chunk, compress, dtype, **provenance_info) as w:
+        for start in range(0, len(s), chunk):
+            part = None if mask is None else np.asarray(mask)[:, start:start+chunk]
+            w.write(*field_map(readout, s[start:start+chunk], y, part))
+    return FieldMapStore(path)
+
+
+class FieldMapStore:
+    """Read access to a store directory; chunks are opened lazily."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as f:
+            self.meta = json.load(f)
+        if self.meta.get('format') != FORMAT:
+            raise ValueError('%s is not a field-map store' % path)
+        if self.meta['version'] > VERSION:
+            raise ValueError('store version %d is newer than this reader (%d)'
+                             % (self.meta['version'], VERSION))
+        self.s = np.load(os.path.join(path, 's.npy'), mmap_mode='r')
+        self.y = np.load(os.path.join(path, 'y.npy'))
+        self.chunk = self.meta['chunk']
+        self.design = self.meta['design']
+        self.provenance = self.meta['provenance']
+        self._chunks = {}
+
+    @property
+    def shape(self):
+        return tuple(self.meta['shape'])
+
+    def _load(self, k):
+        # (bx, by) of chunk k, memory-mapped or decompressed
+        if k not in self._chunks:
+            if self.meta['compress']:
+                with np.load(os.path.join(self.path, 'chunk_%05d.npz' % k)) as data:
+                    self._chunks = {k: (data['bx'], data['by'])}  # keep one decompressed
+            else:
+                self._chunks[k] = tuple(
+                    np.load(os.path.join(self.path, '%s_%05d.npy' % (name, k)), mmap_mode='r')
+                    for name in ('bx', 'by'))
+        return self._chunks[k]
+
+    def columns(self, i0, i1, rows=slice(None)):
+        """(bx, by) of the columns i0:i1 (and rows) as arrays in memory."""
+        i0, i1 = max(0, i0), min(self.shape[1], i1)
+        parts = []
+        for k in range(i0//self.chunk, (i1-1)//self.chunk+1 if i1 > i0 else i0//self.chunk):
+            bx, by = self._load(k)
+            a, b = max(i0-k*self.chunk, 0), min(i1-k*self.chunk, self.chunk)
+            parts.append((bx[rows, a:b], by[rows, a:b]))
+        if not parts:
+            ny = len(self.y[rows])
+            return np.empty((ny, 0)), np.empty((ny, 0))
+        return (np.concatenate([np.asarray(bx) for bx, _ in parts], axis=-1),
+                np.concatenate([np.asarray(by) for _, by in parts], axis=-1))
+
+    def slice(self, s0=None, s1=None, y0=None, y1=None):
+        """(s, y, bx, by) of the samples with s0 <= s <= s1 and y0 <= y <= y1."""
+        i0 = 0 if s0 is None else int(np.searchsorted(self.s, s0, 'left'))
+        i1 = len(self.s) if s1 is None else int(np.searchsorted(self.s, s1, 'right'))
+        j0 = 0 if y0 is None else int(np.searchsorted(self.y, y0, 'left'))
+        j1 = len(self.y) if y1 is None else int(np.searchsorted(self.y, y1, 'right'))
+        bx, by = self.columns(i0, i1, slice(j0, j1))
+        return np.array(self.s[i0:i1]), self.y[j0:j1], bx, by
+
+    def period(self, k, start=0.0, length=None):
+        """slice() of period k, i.e. s in [start+k*length, start+(k+1)*length].
+
+        length defaults to og_thickness of the stored design.
+        """
+        length = self.design['og_thickness'] if length is None else length
+        return self.slice(start+k*length, start+(k+1)*length)
+
+    def line(self, y=0.0):
+        """(s, bx, by) along the stored row nearest to y, e.g. the axis."""
+        j = int(np.argmin(np.abs(self.y-y)))
+        bx, by = self.columns(0, self.shape[1], j)
+        return np.array(self.s), bx, by
+
+    def readout(self):
+        return StoreReadout(self)
+
+
+class StoreReadout:
+    """Readout interpolating a store bilinearly, one chunk of columns at a time.
+
+    Points outside the stored grid are NaN, as with GridReadout.
+    """
+
+    def __init__(self, store):
+        self.store = store
+
+    def getb(self, x, y):
+        x, y = np.broadcast_arrays(np.asarray(x, dtype=float), np.asarray(y, dtype=float))
+        store = self.store
+        s = np.asarray(store.s)
+        bx = np.full(x.shape, np.nan)
+        by = np.full(x.shape, np.nan)
+        # column left of each point; points of one chunk share one GridReadout
+        col = np.clip(np.searchsorted(s, x, 'right')-1, 0, len(s)-2)
+        block = col//store.chunk
+        for k in np.unique(block):
+            sel = block == k
+            i0 = k*store.chunk
+            i1 = min(i0+store.chunk+1, len(s))  # plus the next chunk's first column
+            cbx, cby = store.columns(i0, i1)
+            grid = GridReadout(s[i0:i1], store.y, cbx, cby)
+            bx[sel], by[sel], _ = grid.getb(x[sel], y[sel])
+        return bx, by, np.hypot(bx, by)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+if __name__ == '__main__':
+    command, path = sys.argv[1], sys.argv[2]
+    if command == 'build':
+        from wiggler_analytic import field
+        from wiggler_blocks import onaxis_table
+        from wiggler_design import onaxis_design
+        from wiggler_fieldmap import gap_grid
+        from wiggler_readout import FunctionReadout
+
+        p = onaxis_design()
+        blocks = onaxis_table(p)
+        s, y = gap_grid(p, 20000, 41, 20)
+        t = time.perf_counter()
+        store_field_map(path, FunctionReadout(lambda x, y: field(x, y, blocks)), s, y, p,
+                        solver='analytic')
+        print('%s: %d x %d map in %.1f s' % (path, len(y), len(s), time.perf_counter()-t))
+    elif command == 'report':
+        from wiggler_madx import write_madx
+        from wiggler_multipoles import pole_analysis
+        from wiggler_trajectory import closure, closure_report
+
+        store = FieldMapStore(path)
+        p = store.design
+        s, bx, by = store.line(0)
+        print(closure_report(closure(s, by, [1.54], p['units'])))
+        poles = pole_analysis(store.readout(), p, radius=10)
+        print('%d poles, smallest good-field radius %.2f mm'
+              % (len(poles['s']), poles['r_good'].min()))
+        madx = os.path.join(path, 'wiggler_sliced.madx')
+        print('%s: total angle %.3g' % (madx, write_madx(madx, s, by, 1000, units=p['units'])))
@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+"""
+Parameter sweeps over the onaxis_design parameters.
+
+A design space is a list of override dicts for onaxis_design (magnetSep,
+magnetWidth, magnetType, numrepeats, ...), built with grid() or sample().
+sweep() runs every case in its own worker process with its own scratch
+directory, at most `workers` at a time, and collects one row per case with
+the peak field, the field integrals at the exit and the wall time. A case
+that raises, crashes its process or runs past the timeout is recorded with
+its status and error instead of stopping the sweep.
+
+The solver is any module level function solver(p, scratch, numpoints)
+returning (s, by) on axis, optionally followed by a dict of extra result
+columns. femm_solver runs the full FEMM model (under Wine
+on Linux), analytic_solver the iron-free analytic engine, which needs
+nothing but NumPy and is what CI uses.
+
+    python wiggler_sweep.py [analytic|femm] [mesh.json]
+"""
+
+import csv
+import itertools
+import multiprocessing
+import multiprocessing.connection
+import os
+import shutil
+import sys
+import tempfile
+import time
+import traceback
+
+import numpy as np
+
+from wiggler_analytic import onaxis_profile
+from wiggler_blocks import onaxis_table, validate
+from wiggler_design import UNIT_LENGTH, onaxis_design
+from wiggler_femfile import build_onaxis_model, solve
+from wiggler_readout import FemmReadout, profile, symmetric_readout
+from wiggler_trajectory import cumtrapz, field_integrals
+
+
+def grid(**axes):
+    """Every combination of the given values, e.g. grid(magnetSep=[20, 25])."""
+    names = list(axes)
+    return [dict(zip(names, values)) for values in itertools.product(*axes.values())]
+
+
+def sample(n, seed=0, **ranges):
+    """n random cases, one stratum per case along every axis (Latin hypercube).
+
+    A range is a (low, high) tuple for a continuous parameter or a list of
+    choices for a discrete one (magnetType=['N52', 'SmCo32'], numrepeats=[37, 39]).
+    """
+    rng = np.random.default_rng(seed)
+    cases = [{} for _ in range(n)]
+    for name, values in ranges.items():
+        strata = (rng.permutation(n)+rng.random(n))/n
+        if isinstance(values, tuple):
+            low, high = values
+            column = [low+u*(high-low) for u in strata]
+        else:
+            column = [values[int(u*len(values))] for u in strata]
+        for case, value in zip(cases, column):
+            case[name] = value.item() if isinstance(value, np.generic) else value
+    return cases
+
+
+def analytic_solver(p, scratch, numpoints):
+    # no cutoff: the window keeps the exit angle at zero, but dropping the
+    # far blocks still moves the exit offset by several percent
+    validate(onaxis_table(p))
+    s, bx, by = onaxis_profile(p, numpoints)
+    return s, by
+
+
+def femm_solver(p, scratch, numpoints):
+    import femm
+    femm.openfemm(1)
+    try:
+        solve(build_onaxis_model(p), os.path.join(scratch, 'wiggle.FEM'), femm)
+        with FemmReadout(femm, scratch) as readout:
+            readout = symmetric_readout(readout, p)
+            s, bx, by, bmag = profile(readout, 0, 0, p['lengthtotal']+2*p['margin'], 0, numpoints)
+        elements = femm.mo_numelements()
+    finally:
+        femm.closefemm()
+    return s, by, dict(elements=elements)
+
+
+SOLVERS = {'analytic': analytic_solver, 'femm': femm_solver}
+
+
+def run_case(solver, overrides, scratch, numpoints=25000):
+    """Solve one case in this process and reduce it to a result row."""
+    t = time.perf_counter()
+    p = onaxis_design(**overrides)
+    s, by, *extra = solver(p, scratch, numpoints)
+    i1, i2 = field_integrals(s, by, p['units'])
+    ib2 = cumtrapz(np.square(by), np.asarray(s)*UNIT_LENGTH[p['units']])[-1]
+    row = dict(peak_By=float(np.max(np.abs(by))), I1=float(i1[-1]), I2=float(i2[-1]),
+               IB2=float(ib2))
+    for columns in extra:
+        row.update(columns)
+    row['time'] = time.perf_counter()-t
+    return row
+
+
+def _worker(conn, solver, overrides, scratch, numpoints):
+    try:
+        result = dict(run_case(solver, overrides, scratch, numpoints), status='ok', error='')
+    except Exception:
+        result = dict(status='failed', error=traceback.format_exc(limit=3).strip().splitlines()[-1])
+    conn.send(result)
+    conn.close()
+
+
+def sweep(cases, solver=analytic_solver, workers=None, timeout=None, numpoints=25000,
+          scratch_root=None, keep_scratch=False, verbose=False, mesh=None):
+    """Run every case in its own process and return one result dict per case.
+
+    Rows are in the order of cases and hold the case number, the overrides,
+    status ('ok', 'failed', 'crashed' or 'timeout'), error, peak_By [T],
+    I1 [T.m], I2 [T.m^2], IB2 = int By^2 ds [T^2.m] (for wiggler_focusing.rank)
+    and time [s]. timeout is per case in seconds.
+    mesh holds mesh settings applied under every case, as a dict or the
+    name of a file saved by wiggler_mesh.save_mesh_defaults; by default
+    none.
+    """
+    if isinstance(mesh, str):
+        from wiggler_mesh import mesh_defaults
+        mesh = mesh_defaults(mesh)
+    mesh = mesh or {}
+    workers = workers or os.cpu_count() or 1
+    ctx = multiprocessing.get_context('spawn')
+    root = tempfile.mkdtemp(prefix='wiggler_sweep_', dir=scratch_root)
+    results = [None]*len(cases)
+    pending = list(enumerate(cases))[::-1]
+    running = {}  # sentinel -> (case, process, connection, scratch, start)
+
+    def finish(i, row, process, conn, scratch):
+        process.join()
+        conn.close()
+        if not keep_scratch:
+            shutil.rmtree(scratch, ignore_errors=True)
+        row = dict(dict(status='', peak_By=np.nan, I1=np.nan, I2=np.nan, IB2=np.nan, time=np.nan,
+                        error=''), **row)
+        results[i] = dict(dict(case=i, **cases[i]), **row)
+        if verbose:
+            print('case %d/%d %s %s' % (i+1, len(cases), row['status'], row['error']))
+
+    try:
+        while pending or running:
+            while pending and len(running) < workers:
+                i, overrides = pending.pop()
+                scratch = os.path.join(root, 'case%d' % i)
+                os.makedirs(scratch)
+                parent, child = ctx.Pipe(duplex=False)
+                process = ctx.Process(target=_worker, daemon=True,
+                                      args=(child, solver, dict(mesh, **overrides), scratch,
+                                            numpoints))
+                process.start()
+                child.close()
+                running[process.sentinel] = (i, process, parent, scratch, time.monotonic())
+
+            wait = None
+            if timeout is not None:
+                first = min(start for _, _, _, _, start in running.values())
+                wait = max(0, first+timeout-time.monotonic())
+            multiprocessing.connection.wait(list(running), wait)
+
+            for sentinel, (i, process, conn, scratch, start) in list(running.items()):
+                if conn.poll():
+                    try:
+                        row = conn.recv()
+                    except EOFError:
+                        row = None
+                elif not process.is_alive():
+                    row = None
+                elif timeout is not None and time.monotonic()-start > timeout:
+                    process.terminate()
+                    row = dict(status='timeout', error='no result after %g s' % timeout,
+                               time=time.monotonic()-start)
+                else:
+                    continue
+                if row is None:
+                    process.join()
+                    row = dict(status='crashed', error='exit code %s' % process.exitcode)
+                del running[sentinel]
+                finish(i, row, process, conn, scratch)
+    finally:
+        for i, process, conn, scratch, start in running.values():
+            process.terminate()
+        if not keep_scratch:
+            shutil.rmtree(root, ignore_errors=True)
+    return results
+
+
+def write_csv(results, filename):
+    """Write sweep results as a table, one row per case."""
+    columns = []
+    for row in results:
+        columns += [k for k in row if k not in columns]
+    with open(filename, 'w', newline='') as f:
+        writer = csv.DictWriter(f, columns)
+        writer.writeheader()
+        writer.writerows(results)
+    return filename
+
+
+if __name__ == '__main__':
+    solver = SOLVERS[sys.argv[1] if len(sys.argv) > 1 else 'analytic']
+    cases = grid(magnetSep=[20, 25, 30], magnetWidth=[100, 150], magnetType=['N52', 'SmCo32'])
+    mesh = sys.argv[2] if len(sys.argv) > 2 else None
+    results = sweep(cases, solver, timeout=600, verbose=True, mesh=mesh)
+    print(write_csv(results, 'wiggler_sweep.csv'))
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+End-taper optimisation.
+
+wiggler_6_onaxis.py puts the end magnets at magnetSep*2 ("quarter
+strength") and the penultimate ones at magnetSep*2/sqrt(3) ("3/4
+strength"), an inverse-square-law guess that nothing checks. Here the end
+and penultimate separations (optionally also the widths) are tuned until
+the beam leaves the device with zero angle and offset.
+
+The residual is the exit angle and offset from wiggler_trajectory.closure,
+in units of their tolerances, so |r| <= 1 means closed. Newton iterations
+with a finite-difference Jacobian run on the fast analytic surrogate. The
+expensive solver (FEMM) is only used to check each surrogate optimum. If the
+check fails, the surrogate is shifted by the difference between the two
+models at that point (output space mapping) and optimised again. Typically
+only two or three full solves are needed.
+
+    python wiggler_taper.py [analytic|femm]
+"""
+
+import shutil
+import sys
+import tempfile
+
+import numpy as np
+
+from wiggler_design import onaxis_design
+from wiggler_sweep import SOLVERS, analytic_solver, femm_solver
+from wiggler_trajectory import closure
+
+TAPER = ('endmagnetSep', 'penmagnetSep')
+TAPER_WIDTHS = TAPER+('endmagnetWidth', 'penmagnetWidth')
+
+
+def taper_residual(solver, overrides, energy=1.54, angle_tol=1e-5, offset_tol=1e-5,
+                   numpoints=5000, scratch=None):
+    """(exit angle/angle_tol, exit offset/offset_tol) of one design."""
+    p = onaxis_design(**overrides)
+    s, by, *_ = solver(p, scratch, numpoints)
+    r = closure(s, by, energy, p['units'], angle_tol, offset_tol)
+    return np.array([r['angle'][0]/angle_tol, r['offset'][0]/offset_tol])
+
+
+def _newton(f, x, bounds, step=1e-2, tol=0.1, maxiter=20):
+    # damped Gauss-Newton on f(x) = 0. Directions with small singular values
+    # are dropped: the mirrored device has I1 = 0 by symmetry, so the angle
+    # row of J is nearly zero and only the offset constrains x. Of the
+    # remaining solutions each step aims for the one closest to the start
+    # point, so the taper does not drift along the free directions. Unknowns
+    # held at a bound by the step are frozen and the rest solved again
+    x0 = x
+    low, high = bounds
+    r = f(x)
+    nevals = 1
+    for _ in range(maxiter):
+        if np.abs(r).max() <= tol:
+            break
+        J = np.empty((len(r), len(x)))
+        for j in range(len(x)):
+            dx = np.zeros(len(x))
+            dx[j] = step
+            J[:, j] = (f(x+dx)-r)/step
+        nevals += len(x)
+        free = np.ones(len(x), dtype=bool)
+        while True:
+            delta = np.zeros(len(x))
+            Jf = J[:, free]
+            delta[free] = (x0-x)[free]+np.linalg.lstsq(Jf, -r-Jf @ (x0-x)[free], rcond=1e-2)[0]
+            held = free & (((x <= low) & (delta < 0)) | ((x >= high) & (delta > 0)))
+            if not held.any():
+                break
+            free &= ~held
+        t = 1.0
+        while t > 1e-3:
+            trial = np.clip(x+t*delta, *bounds)
+            rt = f(trial)
+            nevals += 1
+            if np.linalg.norm(rt) < np.linalg.norm(r):
+                break
+            t /= 2
+        else:
+            break  # no descent along the Newton direction
+        x, r = trial, rt
+    return x, r, nevals
+
+
+def optimize_taper(names=TAPER, surrogate=analytic_solver, solver=femm_solver, energy=1.54,
+                   angle_tol=1e-5, offset_tol=1e-5, max_solves=4, numpoints=5000,
+                   solver_numpoints=25000, verbose=False, **design):
+    """Tune the taper parameters names of onaxis_design(**design) to close the orbit.
+
+    Widths not in names keep the value given in design, or else follow their
+    separation as in onaxis_design. Returns a dict with the optimised
+    overrides, the full-solve residual, converged, active (the names held at
+    a bound), the number of surrogate evaluations and of expensive solves,
+    and the history of (overrides, full residual) per expensive solve.
+    """
+    p = onaxis_design(**design)
+    x = np.array([p[name] for name in names], dtype=float)
+    # separations stay outside the pole gap, widths positive
+    low = np.array([p['magnetSep'] if 'Sep' in name else 1.0 for name in names])
+    high = np.array([p['magnetSep']+p['magnetWidth'] if 'Sep' in name else np.inf
+                     for name in names])
+    def overrides(x):
+        return dict(design, **dict(zip(names, map(float, x))))
+
+    def residual(function, x, n, scratch=None):
+        return taper_residual(function, overrides(x), energy, angle_tol, offset_tol, n, scratch)
+
+    shift = 0
+    history = []
+    nsurrogate = 0
+    scratch = tempfile.mkdtemp(prefix='wiggler_taper_')
+    try:
+        for _ in range(max_solves):
+            x, r, n = _newton(lambda x: residual(surrogate, x, numpoints)+shift, x, (low, high))
+            nsurrogate += n
+            full = residual(solver, x, solver_numpoints, scratch)
+            history.append((overrides(x), full))
+            active = [name for name, xi, lo, hi in zip(names, x, low, high) if xi <= lo or xi >= hi]
+            if verbose:
+                print('solve %d: %s -> angle %.3g, offset %.3g (x tol)%s'
+                      % (len(history), np.round(x, 4), full[0], full[1],
+                         ', at bound: '+', '.join(active) if active else ''))
+            if np.abs(full).max() <= 1:
+                break
+            shift = full-residual(surrogate, x, numpoints)
+            nsurrogate += 1
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+    return dict(overrides=history[-1][0], residual=history[-1][1],
+                converged=bool(np.abs(history[-1][1]).max() <= 1), active=active,
+                surrogate_evals=nsurrogate, solves=len(history), history=history)
+
+
+if __name__ == '__main__':
+    result = optimize_taper(solver=SOLVERS[sys.argv[1] if len(sys.argv) > 1 else 'femm'],
+                            verbose=True)
+    print(result['overrides'])
+    print('converged' if result['converged'] else 'not converged', 'after',
+          result['solves'], 'expensive solves and', result['surrogate_evals'], 'surrogate evaluations')
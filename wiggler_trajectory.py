@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""
+Beam trajectory through the wiggler from the on-axis field profile.
+
+"Is the beam trajectory closed? I.e. does the beam have the zero position
+and angle offset when exiting the wiggler?"
+
+The first integral I1(s) = int By ds gives the angle and the second
+integral I2(s) = int I1 ds the offset of a particle going through the
+device. To first order in the deflection (a few mrad here) a particle of
+rigidity Brho entering on axis follows
+
+    x'(s) = x0' - I1(s)/Brho,    x(s) = x0 + x0'*s - I2(s)/Brho
+
+so the integrals are computed once and every beam energy is a broadcast
+division. The trajectory is closed when the exit angle and offset are
+within tolerance.
+
+    python wiggler_trajectory.py [E_GeV ...]
+"""
+
+import sys
+
+import numpy as np
+
+from wiggler_design import UNIT_LENGTH
+
+C_LIGHT = 0.299792458  # Brho [T.m] = C_LIGHT^-1 * p [GeV/c]
+ELECTRON_MASS = 0.51099895e-3  # GeV
+
+
+def cumtrapz(y, s):
+    """Cumulative trapezoidal integral of y over s along the last axis, starting at 0."""
+    y = np.asarray(y, dtype=float)
+    ds = np.diff(np.asarray(s, dtype=float))
+    out = np.zeros(y.shape)
+    np.cumsum(0.5*(y[..., 1:]+y[..., :-1])*ds, axis=-1, out=out[..., 1:])
+    return out
+
+
+def field_integrals(s, by, units='millimeters'):
+    """Cumulative first and second field integrals of By [T] along s.
+
+    s is in the problem length unit; I1 is returned in T.m and I2 in T.m^2.
+    """
+    s = np.asarray(s, dtype=float)*UNIT_LENGTH[units]
+    i1 = cumtrapz(by, s)
+    return i1, cumtrapz(i1, s)
+
+
+def rigidity(energy, mass=ELECTRON_MASS):
+    """Magnetic rigidity Brho [T.m] for total energies [GeV] of a singly charged particle."""
+    energy = np.asarray(energy, dtype=float)
+    return np.sqrt(energy**2-mass**2)/C_LIGHT
+
+
+def trajectory(s, by, energies, units='millimeters', x0=0, xp0=0):
+    """Horizontal angle and position along the device for every energy.
+
+    energies [GeV] may be a scalar or an array; the returned (xp, x) in rad
+    and m have shape energies.shape + s.shape. x0 [m] and xp0 [rad] are the
+    entrance position and angle.
+    """
+    i1, i2 = field_integrals(s, by, units)
+    s = np.asarray(s, dtype=float)*UNIT_LENGTH[units]
+    brho = rigidity(energies)[..., None]
+    xp = xp0-i1/brho
+    x = x0+xp0*(s-s[0])-i2/brho
+    return xp, x
+
+
+def closure(s, by, energies, units='millimeters', angle_tol=1e-5, offset_tol=1e-5):
+    """Exit angle and offset of an on-axis beam, and whether they close.
+
+    Only the exit values are needed, so no trajectory arrays are built. The
+    tolerances are in rad and m. Returns a dict of arrays over energies
+    (energy, brho, angle, offset, max_offset, closed) plus the exit field
+    integrals I1 [T.m] and I2 [T.m^2].
+    """
+    i1, i2 = field_integrals(s, by, units)
+    energies = np.atleast_1d(np.asarray(energies, dtype=float))
+    brho = rigidity(energies)
+    angle = -i1[-1]/brho
+    offset = -i2[-1]/brho
+    return dict(energy=energies, brho=brho, angle=angle, offset=offset,
+                max_offset=np.abs(i2).max()/brho,
+                closed=(np.abs(angle) <= angle_tol) & (np.abs(offset) <= offset_tol),
+                I1=i1[-1], I2=i2[-1], angle_tol=angle_tol, offset_tol=offset_tol)
+
+
+def closure_report(result):
+    """Printable pass/fail table of a closure() result."""
+    lines = ['I1 = %.4g T.m, I2 = %.4g T.m^2 at the exit' % (result['I1'], result['I2']),
+             'tolerance %.3g rad, %.3g m' % (result['angle_tol'], result['offset_tol']),
+             '%10s %14s %14s %14s %6s' % ('E [GeV]', 'angle [rad]', 'offset [m]',
+                                          'max |x| [m]', '')]
+    for e, a, x, xm, ok in zip(result['energy'], result['angle'], result['offset'],
+                               result['max_offset'], result['closed']):
+        lines.append('%10.4g %14.4g %14.4g %14.4g %6s' % (e, a, x, xm, 'pass' if ok else 'FAIL'))
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    from wiggler_analytic import onaxis_profile
+    from wiggler_design import onaxis_design
+    from wiggler_headless import pyplot, show
+
+    energies = [float(e) for e in sys.argv[1:]] or [1.54]  # pDR energy
+    p = onaxis_design()
+    s, bx, by = onaxis_profile(p, 25000)
+    print(closure_report(closure(s, by, energies, p['units'])))
+    xp, x = trajectory(s, by, energies, p['units'])
+    plt = pyplot()
+    for e, xe in zip(energies, x):
+        plt.plot(s, xe*1e3, label='%g GeV' % e)
+    plt.xlabel('s [mm]')
+    plt.ylabel('x [mm]')
+    plt.legend()
+    show('wiggler_trajectory')